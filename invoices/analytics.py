@@ -0,0 +1,90 @@
+# invoices/analytics.py
+
+from .counters import counters_current, read_counter, summarize_from_counters
+from .models import Invoice, RevenueCounter
+from .rates import RateUnavailable
+
+
+def aggregate_invoices(match, group):
+    pipeline = [{"$match": match}] if match else []
+    pipeline.append({"$group": dict(group, _id=None)})
+    results = list(Invoice._get_collection().aggregate(pipeline))
+    return results[0] if results else None
+
+
+def revenue_by_currency(match=None):
+    """Invoice count, original-currency sum and USD sum per currency, from a
+    single $group."""
+    pipeline = [{"$match": match}] if match else []
+    pipeline += [
+        {
+            "$group": {
+                "_id": "$currency",
+                "count": {"$sum": 1},
+                "sum_amount": {"$sum": "$amount"},
+                "sum_usd": {"$sum": "$converted_amount"},
+            }
+        },
+        {"$sort": {"_id": 1}},
+    ]
+    return [
+        {"currency": row["_id"], "count": row["count"], "sum_amount": row["sum_amount"], "sum_usd": row["sum_usd"]}
+        for row in Invoice._get_collection().aggregate(pipeline)
+    ]
+
+
+def revenue_at_rates(match, table, target_currency):
+    """Total revenue with every invoice's original amount re-valued at the
+    rates in `table`, instead of the rate stored when it was created.
+
+    Returns (total, USD-to-target rate). A table without the target currency
+    raises RateUnavailable naming it, before any invoice currency is priced.
+    """
+    usd_rate = table.rate("USD", target_currency)
+    total = 0.0
+    unpriced = []
+    for row in revenue_by_currency(match):
+        try:
+            total += row["sum_amount"] * table.rate(row["currency"], target_currency)
+        except RateUnavailable:
+            unpriced.append(row["currency"])
+    if unpriced:
+        raise RateUnavailable(f"No rate for {', '.join(unpriced)} in the table from {table.fetched_at}")
+    return total, usd_rate
+
+
+def counters_cover(match):
+    # Revenue counters are kept per currency and overall, nothing finer, and
+    # are only trusted once they account for every invoice.
+    return (not match or set(match) == {"currency"}) and counters_current()
+
+
+def total_revenue_usd(match=None):
+    if counters_cover(match):
+        return read_counter((match or {}).get("currency", RevenueCounter.ALL_KEY))["sum_usd"]
+    # converted_amount is stored in USD, so the sum never leaves the server.
+    result = aggregate_invoices(match, {"total": {"$sum": "$converted_amount"}})
+    return result["total"] if result else 0.0
+
+
+def summarize_invoices(match=None):
+    """Count, sum, mean, min, max and population standard deviation of
+    converted_amount (USD), all from one aggregation pass, or from the
+    revenue counters when the filter allows it."""
+    if counters_cover(match):
+        return summarize_from_counters((match or {}).get("currency"))
+    result = aggregate_invoices(
+        match,
+        {
+            "count": {"$sum": 1},
+            "total": {"$sum": "$converted_amount"},
+            "min": {"$min": "$converted_amount"},
+            "max": {"$max": "$converted_amount"},
+            "std_dev": {"$stdDevPop": "$converted_amount"},
+        },
+    )
+    if not result:
+        return {"count": 0, "total": 0.0, "mean": 0.0, "min": 0.0, "max": 0.0, "std_dev": 0.0}
+    result.pop("_id")
+    result["mean"] = result["total"] / result["count"]
+    return result
@@ -1,5 +1,17 @@
 from django.apps import AppConfig
 
+from invoices_api import settings
+
 
 class InvoicesConfig(AppConfig):
     name = "invoices"
+
+    def ready(self):
+        # Registers the invoice write hooks; response_cache goes last so its
+        # version bump follows the derived-data updates.
+        from . import counters, rollups, sketches, response_cache  # noqa: F401
+        # Imported either way, so /metrics always reports the refresher.
+        from .refresher import rate_refresher
+
+        if settings.EXCHANGE_RATE_REFRESHER_ENABLED and not settings.IS_TEST:
+            rate_refresher.start()
@@ -0,0 +1,124 @@
+# invoices/async_views.py
+"""Async counterparts of the invoice create and analytics views.
+
+Rate and currency lookups are awaited through the provider's async client,
+and MongoEngine calls run in a worker thread, so under ASGI one process keeps
+serving requests while provider calls are in flight.
+"""
+
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views import View
+
+from .analytics import summarize_invoices, total_revenue_usd
+from .filters import FilterError, build_invoice_match
+from .models import Invoice
+from .serializers import InvoiceSerializer
+from .utils import aget_exchange_rate, aget_supported_currencies, aget_usd_conversion
+from .views import invoice_statistics
+
+
+def run_off_loop(func, *args):
+    return sync_to_async(func, thread_sensitive=False)(*args)
+
+
+async def validate_target_currency(target_currency):
+    try:
+        supported_currencies = await aget_supported_currencies()
+    except Exception as e:
+        return JsonResponse(
+            {"detail": f"Unable to retrieve supported currencies at this time.Due To: {str(e)}"},
+            status=503,
+        )
+    if target_currency not in supported_currencies:
+        return JsonResponse({"currency": f"Unsupported currency '{target_currency}'."}, status=400)
+    return None
+
+
+def conversion_failed(target_currency, error):
+    return JsonResponse({"detail": f"Failed to convert USD to {target_currency}: {str(error)}"}, status=500)
+
+
+class AsyncInvoiceCreateView(View):
+    async def post(self, request):
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse({"detail": "Malformed JSON."}, status=400)
+        serializer = InvoiceSerializer(data=data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=400)
+
+        amount = serializer.validated_data.get("amount")
+        currency = serializer.validated_data.get("currency")
+        error = await validate_target_currency(currency)
+        if error is not None:
+            return error
+        try:
+            exchange_rate = await aget_exchange_rate(currency, "USD")
+        except Exception:
+            return JsonResponse(
+                {"detail": f"Exchange rate for currency '{currency}' is not available."},
+                status=503,
+            )
+        invoice = Invoice(
+            amount=amount,
+            currency=currency,
+            converted_amount=amount * exchange_rate,
+            exchange_rate=exchange_rate,
+        )
+        await run_off_loop(invoice.save)
+        return JsonResponse(InvoiceSerializer(invoice).data, status=201)
+
+
+class AsyncTotalRevenueView(View):
+    async def get(self, request):
+        target_currency = request.GET.get("currency", "USD").upper()
+        error = await validate_target_currency(target_currency)
+        if error is not None:
+            return error
+        try:
+            match = build_invoice_match(request.GET, currency_param="invoice_currency")
+        except FilterError as e:
+            return JsonResponse({e.param: e.message}, status=400)
+
+        total_usd = await run_off_loop(total_revenue_usd, match)
+        if not total_usd:
+            return JsonResponse(
+                {"currency": target_currency, "total_revenue": 0.0, "exchange_rate": None, "rate_timestamp": None}
+            )
+        try:
+            rate, rate_timestamp = await aget_usd_conversion(target_currency)
+        except Exception as e:
+            return conversion_failed(target_currency, e)
+        return JsonResponse(
+            {
+                "currency": target_currency,
+                "total_revenue": round(total_usd * rate, 2),
+                "exchange_rate": rate,
+                "rate_timestamp": rate_timestamp,
+            }
+        )
+
+
+class AsyncAverageInvoiceView(View):
+    async def get(self, request):
+        target_currency = request.GET.get("currency", "USD").upper()
+        error = await validate_target_currency(target_currency)
+        if error is not None:
+            return error
+        try:
+            match = build_invoice_match(request.GET, currency_param="invoice_currency")
+        except FilterError as e:
+            return JsonResponse({e.param: e.message}, status=400)
+
+        stats = await run_off_loop(summarize_invoices, match)
+        if not stats["count"]:
+            return JsonResponse(dict(invoice_statistics(target_currency, stats), exchange_rate=None))
+        try:
+            rate, rate_timestamp = await aget_usd_conversion(target_currency)
+        except Exception as e:
+            return conversion_failed(target_currency, e)
+        return JsonResponse(invoice_statistics(target_currency, stats, rate, rate_timestamp))
@@ -0,0 +1,182 @@
+# invoices/benchmarks.py
+
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from django.test import Client
+from django.urls import reverse
+
+from .bulk import insert_invoice_documents
+from .models import Invoice, QuantileSketch, RevenueCounter, RevenueRollup
+
+SYNTHETIC_CURRENCIES = ("USD", "EUR", "GBP", "EGP", "JPY")
+SYNTHETIC_START = datetime(2025, 1, 1)
+
+
+def synthetic_documents(count, seed=0):
+    rng = random.Random(seed)
+    for i in range(count):
+        amount = round(rng.uniform(1, 10000), 2)
+        rate = round(rng.uniform(0.01, 2), 4)
+        yield {
+            "_id": ObjectId(),
+            "amount": amount,
+            "currency": rng.choice(SYNTHETIC_CURRENCIES),
+            "converted_amount": amount * rate,
+            "exchange_rate": rate,
+            "created_at": SYNTHETIC_START + timedelta(seconds=i, milliseconds=rng.randrange(1000)),
+        }
+
+
+def seed_invoices(count, chunk_size=10000, seed=0):
+    """Replace the invoice collection with `count` synthetic invoices.
+
+    Goes through the bulk insert path, so counters, rollups and quantile
+    sketches are built as the documents land.
+    """
+    for document in (Invoice, RevenueCounter, RevenueRollup, QuantileSketch):
+        document._get_collection().delete_many({})
+    documents = synthetic_documents(count, seed)
+    inserted = 0
+    while inserted < count:
+        chunk = [next(documents) for _ in range(min(chunk_size, count - inserted))]
+        insert_invoice_documents(chunk, chunk_size)
+        inserted += len(chunk)
+    return inserted
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile of an already sorted list.
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-pct * len(sorted_values) // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class Scenario:
+    """One route under load: `request(client, rng)` issues a single call and
+    returns the response."""
+
+    def __init__(self, name, request, expected=(200,)):
+        self.name = name
+        self.request = request
+        self.expected = expected
+
+
+def build_scenarios(sample_ids):
+    """A scenario for every route in invoices/urls.py."""
+    window = f"created_after={SYNTHETIC_START.isoformat()}&created_before={(SYNTHETIC_START + timedelta(seconds=1000)).isoformat()}"
+
+    def pick(rng):
+        return str(rng.choice(sample_ids))
+
+    def invoice(rng):
+        return {"amount": round(rng.uniform(1, 10000), 2), "currency": rng.choice(SYNTHETIC_CURRENCIES)}
+
+    def get(name, query="", **kwargs):
+        return lambda c, rng: c.get(f"{reverse(name, kwargs=kwargs)}?{query}")
+
+    def post(name, body):
+        return lambda c, rng: c.post(reverse(name), body(rng), content_type="application/json")
+
+    def export(c, rng):
+        response = c.get(f"{reverse('invoice-export')}?{window}")
+        # Time the whole stream, not just the first chunk.
+        b"".join(response.streaming_content)
+        return response
+
+    def detail(c, rng):
+        return c.get(reverse("invoice-detail", kwargs={"pk": pick(rng)}))
+
+    def update(c, rng):
+        return c.put(reverse("invoice-detail", kwargs={"pk": pick(rng)}), invoice(rng), content_type="application/json")
+
+    def exchange_rate(c, rng):
+        return c.get(reverse("invoice-exchange-rate", kwargs={"pk": pick(rng)}))
+
+    return [
+        Scenario("invoice_list", get("invoice-list-create", "limit=50")),
+        Scenario("invoice_list_filtered", get("invoice-list-create", "currency=EUR&min_amount=5000&limit=50")),
+        Scenario("invoice_create", post("invoice-list-create", invoice), (201,)),
+        Scenario("invoice_bulk_create", post("invoice-bulk-create", lambda rng: [invoice(rng) for _ in range(100)]), (201,)),
+        Scenario("invoice_export", export),
+        Scenario("invoice_detail", detail),
+        Scenario("invoice_update", update),
+        Scenario("invoice_exchange_rate", exchange_rate),
+        Scenario("total_revenue", get("total-revenue", "currency=EUR")),
+        Scenario("total_revenue_filtered", get("total-revenue", "currency=EUR&min_amount=5000")),
+        Scenario("average_invoice", get("average-invoice", "currency=GBP")),
+        Scenario("revenue_series", get("revenue-series", "interval=day&currency=EUR")),
+        Scenario("distribution", get("distribution", "currency=EUR")),
+        Scenario("approximate_percentiles", get("approximate-percentiles", "currency=EUR")),
+        Scenario("revenue_by_currency", get("revenue-by-currency", "currency=EUR")),
+        Scenario("async_invoice_create", post("async-invoice-create", invoice), (201,)),
+        Scenario("async_total_revenue", get("async-total-revenue", "currency=EUR")),
+        Scenario("async_average_invoice", get("async-average-invoice", "currency=GBP")),
+    ]
+
+
+def run_scenario(scenario, requests, concurrency, seed=0):
+    """Drive one scenario from `concurrency` threads and summarise latencies."""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    local = threading.local()
+
+    def one(i):
+        nonlocal errors
+        if not hasattr(local, "client"):
+            local.client = Client()
+        rng = random.Random(seed * 1_000_003 + i)
+        started = time.perf_counter()
+        try:
+            ok = scenario.request(local.client, rng).status_code in scenario.expected
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / wall, 2) if wall else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def compare_reports(baseline, current, threshold=0.2):
+    """Routes whose p95 grew or throughput fell by more than `threshold`."""
+    regressions = {}
+    for name, now in current["routes"].items():
+        before = baseline.get("routes", {}).get(name)
+        if not before:
+            continue
+        problems = {}
+        if before["p95_ms"] and now["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            problems["p95_ms"] = (before["p95_ms"], now["p95_ms"])
+        if before["throughput_rps"] and now["throughput_rps"] < before["throughput_rps"] * (1 - threshold):
+            problems["throughput_rps"] = (before["throughput_rps"], now["throughput_rps"])
+        if problems:
+            regressions[name] = problems
+    return regressions
+
+
+def load_report(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
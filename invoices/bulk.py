@@ -0,0 +1,84 @@
+# invoices/bulk.py
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from invoices_api import settings
+from . import events
+from .models import Invoice, utcnow_millis
+from .serializers import InvoiceSerializer
+from .utils import get_exchange_rate
+
+
+class RateResolver:
+    """Looks up each distinct currency's USD rate once per batch."""
+
+    def __init__(self, lookup=None):
+        self.lookup = lookup or get_exchange_rate
+        self._rates = {}
+
+    def __call__(self, currency):
+        if currency not in self._rates:
+            try:
+                self._rates[currency] = (self.lookup(currency, "USD"), None)
+            except Exception as e:
+                self._rates[currency] = (None, e)
+        rate, error = self._rates[currency]
+        if error is not None:
+            raise error
+        return rate
+
+
+def build_invoice_document(amount, currency, exchange_rate, created_at=None):
+    created_at = created_at or utcnow_millis()
+    return {
+        "_id": ObjectId(),
+        "amount": amount,
+        "currency": currency,
+        "converted_amount": amount * exchange_rate,
+        "exchange_rate": exchange_rate,
+        "created_at": created_at,
+        "version": 1,
+        "updated_at": created_at,
+    }
+
+
+def prepare_invoice(data, supported_currencies, resolve_rate):
+    """Validate one incoming invoice and build its document.
+
+    Returns (document, None) or (None, errors) in the same shape the single
+    create endpoint reports.
+    """
+    serializer = InvoiceSerializer(data=data)
+    if not serializer.is_valid():
+        return None, serializer.errors
+    amount = serializer.validated_data["amount"]
+    currency = serializer.validated_data["currency"]
+    if currency not in supported_currencies:
+        return None, {"currency": f"Unsupported currency '{currency}'."}
+    try:
+        exchange_rate = resolve_rate(currency)
+    except Exception:
+        return None, {"detail": f"Exchange rate for currency '{currency}' is not available."}
+    return build_invoice_document(amount, currency, exchange_rate), None
+
+
+def insert_invoice_documents(documents, chunk_size=None):
+    """Write documents with unordered insert_many in chunks.
+
+    Returns a dict mapping the _id of each document that failed to insert
+    to its error message (empty if all succeeded); one bad document does
+    not stop the rest of its chunk.
+    """
+    collection = Invoice._get_collection()
+    chunk_size = chunk_size or settings.INVOICE_BULK_CHUNK_SIZE
+    failed = {}
+    for start in range(0, len(documents), chunk_size):
+        chunk = documents[start:start + chunk_size]
+        try:
+            collection.insert_many(chunk, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed[chunk[error["index"]]["_id"]] = error.get("errmsg", "Write failed.")
+        events.invoices_created(doc for doc in chunk if doc["_id"] not in failed)
+    return failed
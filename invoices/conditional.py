@@ -0,0 +1,51 @@
+# invoices/conditional.py
+
+import hashlib
+from datetime import timezone
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+# Enough of a stored invoice to validate a cached copy of it.
+VALIDATOR_FIELDS = ("version", "updated_at", "created_at")
+
+
+def document_etag(doc):
+    # Every save bumps the version, so (id, version) names one representation.
+    return f'"{doc["_id"]}.{doc.get("version") or 1}"'
+
+
+def page_etag(docs, *cursors):
+    digest = hashlib.sha1(usedforsecurity=False)
+    for doc in docs:
+        digest.update(f"{doc['_id']}.{doc.get('version') or 1};".encode())
+    digest.update("|".join(cursor or "" for cursor in cursors).encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def last_modified(*docs):
+    """Newest updated_at (or created_at, for documents that predate it) as a
+    POSIX timestamp, or None."""
+    stamps = [doc.get("updated_at") or doc.get("created_at") for doc in docs]
+    stamps = [stamp for stamp in stamps if stamp is not None]
+    if not stamps:
+        return None
+    newest = max(stamps)
+    if newest.tzinfo is None:
+        newest = newest.replace(tzinfo=timezone.utc)
+    return int(newest.timestamp())
+
+
+def set_validators(response, etag, modified):
+    response["ETag"] = etag
+    if modified is not None:
+        response["Last-Modified"] = http_date(modified)
+    return response
+
+
+def not_modified(request, etag, modified):
+    """A 304 carrying the validators if the client's copy is current, else None."""
+    response = get_conditional_response(request, etag=etag, last_modified=modified)
+    if response is None:
+        return None
+    return set_validators(response, etag, modified)
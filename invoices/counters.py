@@ -0,0 +1,160 @@
+# invoices/counters.py
+
+import math
+from collections import defaultdict
+
+from pymongo import UpdateOne
+
+from . import events
+from .models import Invoice, RevenueCounter
+
+COUNTER_FIELDS = ("count", "sum_usd", "sum_sq_usd", "sum_amount")
+
+
+def counter_deltas(created=(), deleted=()):
+    deltas = defaultdict(lambda: dict.fromkeys(COUNTER_FIELDS, 0))
+    for documents, sign in ((created, 1), (deleted, -1)):
+        for doc in documents:
+            usd = doc.get("converted_amount") or 0.0
+            for key in (RevenueCounter.ALL_KEY, doc["currency"]):
+                delta = deltas[key]
+                delta["count"] += sign
+                delta["sum_usd"] += sign * usd
+                delta["sum_sq_usd"] += sign * usd * usd
+                delta["sum_amount"] += sign * (doc.get("amount") or 0.0)
+    return deltas
+
+
+@events.on_change
+def update_revenue_counters(created, deleted):
+    # One atomic $inc per touched key, however many invoices changed.
+    operations = [
+        UpdateOne({"_id": key}, {"$inc": delta}, upsert=True)
+        for key, delta in counter_deltas(created, deleted).items()
+    ]
+    if not operations:
+        return
+    try:
+        RevenueCounter._get_collection().bulk_write(operations, ordered=False)
+    except Exception:
+        # Some increments may have landed and some not; stop trusting the
+        # counters until they are reconciled.
+        mark_counters_dirty()
+        raise
+
+
+def mark_counters_dirty():
+    RevenueCounter._get_collection().update_one({"_id": RevenueCounter.ALL_KEY}, {"$set": {"dirty": True}}, upsert=True)
+
+
+def clear_counters_dirty():
+    RevenueCounter._get_collection().update_one({"_id": RevenueCounter.ALL_KEY}, {"$set": {"dirty": False}})
+
+
+def read_counter(key=RevenueCounter.ALL_KEY):
+    doc = RevenueCounter._get_collection().find_one({"_id": key}) or {}
+    return {field: doc.get(field, 0) for field in COUNTER_FIELDS}
+
+
+def counters_current():
+    """True when the counters can be trusted: no update has failed since the
+    last reconcile and the overall count accounts for every invoice.
+
+    False on a database whose invoices predate the counters (or whose counter
+    documents were dropped), or after a failed update, until
+    `reconcile_revenue_counters` rebuilds them; a write landing between the
+    two reads also reads as False, which only costs one aggregation.
+    """
+    doc = RevenueCounter._get_collection().find_one({"_id": RevenueCounter.ALL_KEY}, {"count": 1, "dirty": 1})
+    if doc is None or doc.get("dirty"):
+        return False
+    return doc.get("count") == Invoice._get_collection().estimated_document_count()
+
+
+def _extreme(match, direction):
+    doc = (
+        Invoice._get_collection()
+        .find(match, {"converted_amount": 1, "_id": 0})
+        .sort("converted_amount", direction)
+        .limit(1)
+    )
+    doc = next(doc, None)
+    return doc["converted_amount"] if doc else 0.0
+
+
+def summarize_from_counters(currency=None):
+    """Same shape as analytics.summarize_invoices, read in constant time.
+
+    count/sum/mean/std_dev come from the counter document; min and max are a
+    single index probe each on converted_amount.
+    """
+    counter = read_counter(currency or RevenueCounter.ALL_KEY)
+    count = counter["count"]
+    if count <= 0:
+        return {"count": 0, "total": 0.0, "mean": 0.0, "min": 0.0, "max": 0.0, "std_dev": 0.0}
+    mean = counter["sum_usd"] / count
+    variance = max(counter["sum_sq_usd"] / count - mean * mean, 0.0)
+    match = {"currency": currency} if currency else {}
+    return {
+        "count": count,
+        "total": counter["sum_usd"],
+        "mean": mean,
+        "min": _extreme(match, 1),
+        "max": _extreme(match, -1),
+        "std_dev": math.sqrt(variance),
+    }
+
+
+def compute_counters():
+    """Recompute every counter from the invoice collection."""
+    pipeline = [
+        {
+            "$group": {
+                "_id": "$currency",
+                "count": {"$sum": 1},
+                "sum_usd": {"$sum": "$converted_amount"},
+                "sum_sq_usd": {"$sum": {"$multiply": ["$converted_amount", "$converted_amount"]}},
+                "sum_amount": {"$sum": "$amount"},
+            }
+        }
+    ]
+    counters = {}
+    overall = dict.fromkeys(COUNTER_FIELDS, 0)
+    for row in Invoice._get_collection().aggregate(pipeline):
+        values = {field: row[field] for field in COUNTER_FIELDS}
+        counters[row["_id"]] = values
+        for field in COUNTER_FIELDS:
+            overall[field] += values[field]
+    counters[RevenueCounter.ALL_KEY] = overall
+    return counters
+
+
+def stored_counters():
+    return {
+        doc["_id"]: {field: doc.get(field, 0) for field in COUNTER_FIELDS}
+        for doc in RevenueCounter._get_collection().find()
+    }
+
+
+def counter_drift(expected, stored, tolerance=1e-6):
+    drift = {}
+    for key in sorted(set(expected) | set(stored)):
+        want = expected.get(key, dict.fromkeys(COUNTER_FIELDS, 0))
+        have = stored.get(key, dict.fromkeys(COUNTER_FIELDS, 0))
+        diff = {
+            field: have[field] - want[field]
+            for field in COUNTER_FIELDS
+            if abs(have[field] - want[field]) > tolerance * max(1.0, abs(want[field]))
+        }
+        if diff:
+            drift[key] = diff
+    return drift
+
+
+def replace_counters(counters):
+    collection = RevenueCounter._get_collection()
+    collection.delete_many({"_id": {"$nin": list(counters)}})
+    collection.bulk_write(
+        [UpdateOne({"_id": key}, {"$set": {**values, "dirty": False}}, upsert=True) for key, values in counters.items()],
+        ordered=False,
+    )
@@ -0,0 +1,140 @@
+# invoices/currencies.py
+
+import asyncio
+import threading
+import time
+
+from invoices_api import settings
+from . import providers
+from .rates import latest_snapshot
+
+
+def fetch_supported_codes():
+    return providers.rate_provider.supported_codes()
+
+
+async def afetch_supported_codes():
+    return await providers.rate_provider.asupported_codes()
+
+
+def snapshot_codes():
+    # Offline fallback: every currency in the newest stored rate table.
+    snapshot = latest_snapshot(settings.EXCHANGE_RATE_BASE_CURRENCY)
+    if snapshot is None:
+        raise LookupError("No stored rate snapshot to take currency codes from.")
+    return {code: code for code in snapshot.rates}
+
+
+class CurrencyRegistry:
+    """Supported currency codes, loaded once and refreshed in the background.
+
+    A failed refresh keeps the last good copy in service; only a registry that
+    has never loaded raises to the caller.
+    """
+
+    def __init__(
+        self,
+        fetch=fetch_supported_codes,
+        refresh_interval=3600,
+        retry_interval=60,
+        afetch=afetch_supported_codes,
+        fallback=None,
+    ):
+        self.fetch = fetch
+        self.afetch = afetch
+        self.fallback = fallback
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self._codes = None
+        self._names = {}
+        self._next_refresh = 0.0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._refreshing = False
+        self.loaded_at = None
+        self.last_error = None
+
+    def _failed(self, error):
+        with self._lock:
+            self.last_error = error
+            self._next_refresh = time.monotonic() + self.retry_interval
+
+    def _store(self, names):
+        with self._lock:
+            self._names = dict(names)
+            self._codes = frozenset(self._names)
+            self.loaded_at = time.time()
+            self.last_error = None
+            self._next_refresh = time.monotonic() + self.refresh_interval
+        return self._codes
+
+    def _load_fallback(self, error):
+        # Only used when nothing has been loaded yet; a loaded registry keeps
+        # its last good copy instead.
+        if self._codes is not None or self.fallback is None:
+            raise error
+        try:
+            names = self.fallback()
+        except Exception:
+            raise error
+        with self._lock:
+            self._names = dict(names)
+            self._codes = frozenset(self._names)
+        return self._codes
+
+    def refresh(self):
+        try:
+            names = self.fetch()
+        except Exception as e:
+            self._failed(e)
+            return self._load_fallback(e)
+        return self._store(names)
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except Exception:
+            pass
+        finally:
+            self._refreshing = False
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_quietly, daemon=True).start()
+
+    def codes(self):
+        codes = self._codes
+        if codes is None:
+            with self._load_lock:
+                return self._codes if self._codes is not None else self.refresh()
+        if time.monotonic() >= self._next_refresh:
+            self._refresh_in_background()
+        return codes
+
+    async def acodes(self):
+        # Once loaded, lookups never wait on the provider, so only the very
+        # first load needs an awaitable fetch.
+        if self._codes is not None:
+            return self.codes()
+        try:
+            names = await self.afetch()
+        except Exception as e:
+            self._failed(e)
+            return await asyncio.to_thread(self._load_fallback, e)
+        return self._store(names)
+
+    def name(self, code):
+        self.codes()
+        return self._names.get(code)
+
+    def __contains__(self, code):
+        return code in self.codes()
+
+
+currency_registry = CurrencyRegistry(
+    refresh_interval=settings.SUPPORTED_CURRENCIES_REFRESH_INTERVAL,
+    fallback=snapshot_codes,
+)
@@ -0,0 +1,210 @@
+# invoices/distribution.py
+
+import threading
+import time
+
+import numpy as np
+
+from invoices_api import settings
+from .models import Invoice
+from .response_cache import data_version
+
+COLUMN_PROJECTION = {"_id": 0, "currency": 1, "amount": 1, "converted_amount": 1, "created_at": 1}
+DISTRIBUTION_FIELDS = ("converted_amount", "amount")
+
+OPERATORS = {
+    "$eq": np.equal,
+    "$gt": np.greater,
+    "$gte": np.greater_equal,
+    "$lt": np.less,
+    "$lte": np.less_equal,
+}
+
+
+class DistributionTooLarge(Exception):
+    pass
+
+
+class InvoiceColumns:
+    """The invoice collection as parallel NumPy arrays, about 26 bytes per
+    invoice. `codes` index into `currencies`."""
+
+    def __init__(self, currencies, codes, amount, converted_amount, created_at):
+        self.currencies = currencies
+        self.codes = codes
+        self.amount = amount
+        self.converted_amount = converted_amount
+        self.created_at = created_at
+
+    def __len__(self):
+        return len(self.codes)
+
+    def mask(self, match):
+        """Row mask equivalent to a build_invoice_match() filter."""
+        mask = np.ones(len(self), dtype=bool)
+        for field, condition in match.items():
+            if field == "currency":
+                if condition not in self.currencies:
+                    return np.zeros(len(self), dtype=bool)
+                mask &= self.codes == self.currencies.index(condition)
+                continue
+            column = getattr(self, field)
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for op, value in condition.items():
+                if field == "created_at":
+                    value = np.datetime64(value, "ms")
+                mask &= OPERATORS[op](column, value)
+        return mask
+
+
+def load_columns(batch_size=None, max_rows=None):
+    """Stream the collection in batches straight into preallocated arrays.
+
+    Only one batch of raw documents is alive at a time; the arrays are sized
+    from the collection count and grown only if inserts land mid-scan.
+    """
+    batch_size = batch_size or settings.DISTRIBUTION_BATCH_SIZE
+    max_rows = max_rows or settings.DISTRIBUTION_MAX_ROWS
+    collection = Invoice._get_collection()
+    capacity = collection.estimated_document_count()
+    if capacity > max_rows:
+        raise DistributionTooLarge(f"{capacity} invoices exceed the in-memory limit of {max_rows}.")
+
+    currencies, index = [], {}
+    codes = np.empty(capacity, dtype=np.uint16)
+    amount = np.empty(capacity, dtype=np.float64)
+    converted = np.empty(capacity, dtype=np.float64)
+    created_at = np.empty(capacity, dtype="datetime64[ms]")
+    size = 0
+
+    batch = []
+    cursor = collection.find({}, COLUMN_PROJECTION, batch_size=batch_size)
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) < batch_size:
+            continue
+        size, codes, amount, converted, created_at = _flush(batch, size, index, currencies, codes, amount, converted, created_at, max_rows)
+        batch = []
+    if batch:
+        size, codes, amount, converted, created_at = _flush(batch, size, index, currencies, codes, amount, converted, created_at, max_rows)
+    return InvoiceColumns(currencies, codes[:size], amount[:size], converted[:size], created_at[:size])
+
+
+def _flush(batch, size, index, currencies, codes, amount, converted, created_at, max_rows):
+    end = size + len(batch)
+    if end > max_rows:
+        raise DistributionTooLarge(f"More than {max_rows} invoices; over the in-memory limit.")
+    if end > len(codes):
+        grow = max(end, len(codes) * 2)
+        codes, amount, converted, created_at = (np.resize(column, grow) for column in (codes, amount, converted, created_at))
+    for doc in batch:
+        if doc["currency"] not in index:
+            index[doc["currency"]] = len(currencies)
+            currencies.append(doc["currency"])
+    n = len(batch)
+    codes[size:end] = np.fromiter((index[doc["currency"]] for doc in batch), np.uint16, n)
+    amount[size:end] = np.fromiter((doc.get("amount") or 0.0 for doc in batch), np.float64, n)
+    converted[size:end] = np.fromiter((doc.get("converted_amount") or 0.0 for doc in batch), np.float64, n)
+    created_at[size:end] = np.array([doc.get("created_at") for doc in batch], dtype="datetime64[ms]")
+    return end, codes, amount, converted, created_at
+
+
+class ColumnCache:
+    """Holds one InvoiceColumns until the data version changes or `max_age`
+    seconds pass.
+
+    Every invoice write in this process bumps the version (see
+    response_cache), so the arrays are rebuilt on the first request after a
+    write. Writes from other processes (other workers, import_invoices) do
+    not reach a per-process cache, so `max_age` bounds how stale the arrays
+    can get; it defaults to ANALYTICS_CACHE_TIMEOUT, like the cached
+    responses. Concurrent requests wait for a single load.
+    """
+
+    def __init__(self, loader=load_columns, version=data_version, max_age=None):
+        self.loader = loader
+        self.version = version
+        self.max_age = max_age
+        self._columns = None
+        self._loaded_version = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def get(self):
+        version = self.version()
+        max_age = self.max_age if self.max_age is not None else settings.ANALYTICS_CACHE_TIMEOUT
+        with self._lock:
+            now = time.monotonic()
+            if self._columns is None or self._loaded_version != version or now - self._loaded_at >= max_age:
+                self._columns = self.loader()
+                self._loaded_version = version
+                self._loaded_at = now
+                self.loads += 1
+            return self._columns
+
+    def clear(self):
+        with self._lock:
+            self._columns = None
+
+
+column_cache = ColumnCache()
+
+
+def describe(values, percentiles, bins):
+    """Count, mean, extremes, percentiles and a fixed-bin histogram."""
+    if not len(values):
+        return {"count": 0, "mean": None, "min": None, "max": None, "median": None, "percentiles": {}, "histogram": None}
+    low, high = float(values.min()), float(values.max())
+    quantiles = np.percentile(values, [50, *percentiles])
+    # A single distinct value still gets `bins` bins, centred on it.
+    counts, edges = np.histogram(values, bins=bins, range=(low, high) if high > low else (low - 0.5, high + 0.5))
+    return {
+        "count": int(len(values)),
+        "mean": float(values.mean()),
+        "min": low,
+        "max": high,
+        "median": float(quantiles[0]),
+        "percentiles": {f"p{p:g}": float(q) for p, q in zip(percentiles, quantiles[1:])},
+        "histogram": {"edges": edges.tolist(), "counts": counts.tolist()},
+    }
+
+
+def distribution(columns, match, field="converted_amount", percentiles=(50, 90, 99), bins=20):
+    """Distribution of `field` over the matching invoices, overall and per
+    currency. The overall figure is omitted for `amount`, whose values are in
+    each invoice's own currency."""
+    mask = columns.mask(match)
+    values = getattr(columns, field)[mask]
+    codes = columns.codes[mask]
+
+    # One stable sort groups rows by currency; each group is then a slice.
+    order = np.argsort(codes, kind="stable")
+    grouped, sorted_codes = values[order], codes[order]
+    bounds = np.flatnonzero(np.diff(sorted_codes)) + 1
+    by_currency = {
+        columns.currencies[int(group_codes[0])]: describe(group, percentiles, bins)
+        for group, group_codes in zip(np.split(grouped, bounds), np.split(sorted_codes, bounds))
+        if len(group)
+    }
+    return {
+        "overall": describe(values, percentiles, bins) if field == "converted_amount" else None,
+        "by_currency": dict(sorted(by_currency.items())),
+    }
+
+
+def scale_summary(summary, rate):
+    """Re-express a USD summary in another currency; every statistic here is
+    linear in the values."""
+    if summary is None or not summary["count"] or rate == 1.0:
+        return summary
+    scaled = dict(summary)
+    for key in ("mean", "min", "max", "median"):
+        scaled[key] = summary[key] * rate
+    scaled["percentiles"] = {name: value * rate for name, value in summary["percentiles"].items()}
+    scaled["histogram"] = {
+        "edges": [edge * rate for edge in summary["histogram"]["edges"]],
+        "counts": summary["histogram"]["counts"],
+    }
+    return scaled
@@ -0,0 +1,45 @@
+# invoices/events.py
+"""Write hooks for derived invoice data.
+
+Every path that writes invoices (Invoice.save, queryset deletes, bulk
+inserts) reports the raw documents it created or removed here, and the
+registered handlers keep their own collections in step. An update is a
+delete of the old values plus a create of the new ones.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+CHANGE_FIELDS = ("amount", "currency", "converted_amount", "created_at")
+
+_handlers = []
+
+
+def on_change(handler):
+    _handlers.append(handler)
+    return handler
+
+
+def dispatch(created=(), deleted=()):
+    created, deleted = list(created), list(deleted)
+    if not created and not deleted:
+        return
+    for handler in _handlers:
+        try:
+            handler(created, deleted)
+        except Exception:
+            # Derived data can be rebuilt; never fail the invoice write for it.
+            logger.exception("Invoice change handler %s failed", handler.__name__)
+
+
+def invoices_created(documents):
+    dispatch(created=documents)
+
+
+def invoices_deleted(documents):
+    dispatch(deleted=documents)
+
+
+def invoice_updated(before, after):
+    dispatch(created=[after], deleted=[before])
@@ -0,0 +1,68 @@
+# invoices/export.py
+
+import csv
+import json
+
+from invoices_api import settings
+from .models import Invoice
+from .serializers import INVOICE_DOCUMENT_FIELDS, InvoiceSerializer, render_invoice_document
+
+EXPORT_FIELDS = tuple(InvoiceSerializer().fields)
+EXPORT_PROJECTION = {field: 1 for field in INVOICE_DOCUMENT_FIELDS if field != "id"}
+
+
+class _LineBuffer:
+    # csv.writer needs a file-like object; we only want the formatted line back.
+    def write(self, value):
+        return value
+
+
+def iter_invoice_documents(match, batch_size=None):
+    """Yield raw invoice documents in (created_at, _id) order.
+
+    The PyMongo cursor fetches `batch_size` documents per round trip, so only
+    one batch is held in memory at a time.
+    """
+    cursor = (
+        Invoice._get_collection()
+        .find(match, EXPORT_PROJECTION, batch_size=batch_size or settings.INVOICE_EXPORT_BATCH_SIZE)
+        .sort([("created_at", 1), ("_id", 1)])
+    )
+    try:
+        yield from cursor
+    finally:
+        cursor.close()
+
+
+def _chunked(lines, size):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= size:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+
+def stream_ndjson(documents, chunk_size=None):
+    lines = (json.dumps(render_invoice_document(doc)) + "\n" for doc in documents)
+    return _chunked(lines, chunk_size or settings.INVOICE_EXPORT_BATCH_SIZE)
+
+
+def stream_csv(documents, chunk_size=None):
+    writer = csv.writer(_LineBuffer())
+
+    def lines():
+        yield writer.writerow(EXPORT_FIELDS)
+        for doc in documents:
+            row = render_invoice_document(doc)
+            yield writer.writerow([row[field] for field in EXPORT_FIELDS])
+
+    return _chunked(lines(), chunk_size or settings.INVOICE_EXPORT_BATCH_SIZE)
+
+
+EXPORT_FORMATS = {
+    "ndjson": (stream_ndjson, "application/x-ndjson"),
+    "csv": (stream_csv, "text/csv"),
+}
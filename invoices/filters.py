@@ -0,0 +1,82 @@
+# invoices/filters.py
+
+from datetime import datetime, timedelta, timezone
+
+from django.utils.dateparse import parse_date, parse_datetime
+
+
+class FilterError(ValueError):
+    def __init__(self, param, message):
+        super().__init__(message)
+        self.param = param
+        self.message = message
+
+
+def parse_datetime_param(params, name, end_of_day=False):
+    """Parse an ISO date or datetime parameter to naive UTC.
+
+    With `end_of_day`, a bare date means the end of that day rather than its
+    start.
+    """
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            parsed = datetime(day.year, day.month, day.day) if day else None
+            if parsed and end_of_day:
+                parsed += timedelta(days=1)
+    except (TypeError, ValueError):
+        # TypeError: a non-string value, e.g. a number in an imported row.
+        parsed = None
+    if parsed is None:
+        raise FilterError(name, f"Invalid date '{value}'. Use ISO 8601, e.g. 2025-05-26 or 2025-05-26T13:21:00Z.")
+    # created_at is stored as naive UTC.
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_amount_param(params, name):
+    value = params.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise FilterError(name, f"Invalid amount '{value}'.") from None
+
+
+def build_invoice_match(params, currency_param="currency"):
+    """Translate query parameters into a raw MongoDB filter on Invoice fields.
+
+    `currency_param` names the parameter that filters on Invoice.currency; the
+    analytics views already use `currency` for the target currency.
+    """
+    match = {}
+    currency = params.get(currency_param)
+    if currency:
+        match["currency"] = currency.upper()
+
+    created_at = {}
+    created_after = parse_datetime_param(params, "created_after")
+    created_before = parse_datetime_param(params, "created_before")
+    if created_after:
+        created_at["$gte"] = created_after
+    if created_before:
+        created_at["$lt"] = created_before
+    if created_at:
+        match["created_at"] = created_at
+
+    amount = {}
+    min_amount = parse_amount_param(params, "min_amount")
+    max_amount = parse_amount_param(params, "max_amount")
+    if min_amount is not None:
+        amount["$gte"] = min_amount
+    if max_amount is not None:
+        amount["$lte"] = max_amount
+    if amount:
+        match["amount"] = amount
+    return match
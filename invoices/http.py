@@ -0,0 +1,256 @@
+# invoices/http.py
+
+import asyncio
+import random
+import threading
+import time
+import weakref
+from collections import deque
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from invoices_api import settings
+from .metrics import PROVIDER_REQUEST_DURATION, registry
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class RetryableResponse(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and lets a single
+    trial call through once `reset_timeout` seconds have passed."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class ProviderClient:
+    """Shared HTTP client for the exchange-rate provider.
+
+    Connections are kept alive in a pool, every request is bounded by connect
+    and read timeouts, transient failures are retried with jittered
+    exponential backoff, and a circuit breaker fails fast once the provider
+    keeps erroring. `aget_json` is the same call for async views, made
+    through an httpx.AsyncClient so the event loop never blocks on the
+    provider.
+    """
+
+    RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
+    # Every live client, so /metrics covers those built for other providers.
+    instances = weakref.WeakSet()
+
+    def __init__(
+        self,
+        base_url,
+        api_key,
+        connect_timeout=3.05,
+        read_timeout=10,
+        max_retries=2,
+        backoff=0.2,
+        backoff_max=2.0,
+        pool_size=10,
+        breaker=None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.pool_size = pool_size
+        # httpx clients are bound to the event loop that first used them.
+        self._async_clients = weakref.WeakKeyDictionary()
+        self.latencies = deque(maxlen=1000)
+        self.calls = 0
+        self.errors = 0
+        self._stats_lock = threading.Lock()
+        ProviderClient.instances.add(self)
+
+    def url(self, *path):
+        return "/".join([self.base_url, self.api_key, *(str(part) for part in path)])
+
+    def _record(self, started, failed):
+        elapsed = time.perf_counter() - started
+        PROVIDER_REQUEST_DURATION.observe(elapsed, base_url=self.base_url, outcome="error" if failed else "ok")
+        with self._stats_lock:
+            self.calls += 1
+            if failed:
+                self.errors += 1
+            self.latencies.append(elapsed)
+        return elapsed
+
+    def _retry_delay(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+    def get_json(self, *path):
+        if not self.breaker.allow():
+            raise CircuitOpen("Exchange-rate provider is unavailable; circuit is open.")
+        url = self.url(*path)
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(self._retry_delay(attempt - 1))
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                if response.status_code in self.RETRYABLE_STATUS:
+                    raise RetryableResponse(f"Provider responded with HTTP {response.status_code}")
+                response.raise_for_status()
+                data = response.json()
+            except (requests.ConnectionError, requests.Timeout, RetryableResponse) as e:
+                self._record(started, failed=True)
+                last_error = e
+                continue
+            except Exception:
+                # Client errors and malformed bodies are not retried, and they
+                # do not say anything about the provider being down.
+                self._record(started, failed=True)
+                self.breaker.record_success()
+                raise
+            self._record(started, failed=False)
+            self.breaker.record_success()
+            return data
+        self.breaker.record_failure()
+        raise last_error
+
+    def _async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            connect_timeout, read_timeout = self.timeout
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            )
+            self._async_clients[loop] = client
+        return client
+
+    async def aget_json(self, *path):
+        if not self.breaker.allow():
+            raise CircuitOpen("Exchange-rate provider is unavailable; circuit is open.")
+        url = self.url(*path)
+        client = self._async_client()
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(self._retry_delay(attempt - 1))
+            started = time.perf_counter()
+            try:
+                response = await client.get(url)
+                if response.status_code in self.RETRYABLE_STATUS:
+                    raise RetryableResponse(f"Provider responded with HTTP {response.status_code}")
+                response.raise_for_status()
+                data = response.json()
+            except (httpx.TransportError, RetryableResponse) as e:
+                self._record(started, failed=True)
+                last_error = e
+                continue
+            except Exception:
+                self._record(started, failed=True)
+                self.breaker.record_success()
+                raise
+            self._record(started, failed=False)
+            self.breaker.record_success()
+            return data
+        self.breaker.record_failure()
+        raise last_error
+
+    def stats(self):
+        with self._stats_lock:
+            latencies = sorted(self.latencies)
+            calls, errors = self.calls, self.errors
+        return {
+            "calls": calls,
+            "errors": errors,
+            "circuit": self.breaker.state,
+            "latency_avg": sum(latencies) / len(latencies) if latencies else 0.0,
+            "latency_max": latencies[-1] if latencies else 0.0,
+        }
+
+
+def build_provider_client(base_url=None, api_key=None):
+    """A ProviderClient configured from settings, optionally for another URL."""
+    return ProviderClient(
+        base_url or settings.EXCHANGE_API_URL,
+        api_key or settings.EXCHANGE_API_KEY,
+        connect_timeout=settings.EXCHANGE_API_CONNECT_TIMEOUT,
+        read_timeout=settings.EXCHANGE_API_READ_TIMEOUT,
+        max_retries=settings.EXCHANGE_API_MAX_RETRIES,
+        backoff=settings.EXCHANGE_API_BACKOFF,
+        backoff_max=settings.EXCHANGE_API_BACKOFF_MAX,
+        pool_size=settings.EXCHANGE_API_POOL_SIZE,
+        breaker=CircuitBreaker(
+            failure_threshold=settings.EXCHANGE_API_CIRCUIT_FAILURE_THRESHOLD,
+            reset_timeout=settings.EXCHANGE_API_CIRCUIT_RESET_TIMEOUT,
+        ),
+    )
+
+
+provider_client = build_provider_client()
+
+
+@registry.register_collector
+def provider_metrics():
+    # Clients are labelled by base URL; two for the same URL report one series.
+    states = {client.base_url: client.breaker.state for client in list(ProviderClient.instances)}
+    return [
+        (
+            "invoices_provider_circuit_state",
+            "gauge",
+            "1 for each provider circuit breaker's current state.",
+            [
+                ({"base_url": base_url, "state": name}, int(name == state))
+                for base_url, state in sorted(states.items())
+                for name in ("closed", "half-open", "open")
+            ],
+        )
+    ]
@@ -0,0 +1,117 @@
+import json
+import platform
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import mongoengine
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from invoices import providers
+from invoices.benchmarks import build_scenarios, compare_reports, load_report, run_scenario, seed_invoices
+from invoices.currencies import currency_registry
+from invoices.models import Invoice
+from invoices.rates import rate_cache
+from invoices_api import settings
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a separate database with synthetic invoices, drive every API route concurrently "
+        "against a local stub rate provider, and report throughput and p50/p95/p99 latency as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--invoices", type=int, default=10000, help="Synthetic invoices to seed (e.g. 10000, 100000, 1000000).")
+        parser.add_argument("--skip-seed", action="store_true", help="Reuse the data already in the benchmark database.")
+        parser.add_argument("--database", default="invoices_benchmark", help="MongoDB database to use; it is overwritten.")
+        parser.add_argument("--requests", type=int, default=200, help="Requests per route.")
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--routes", help="Comma-separated scenario names to run (default: all).")
+        parser.add_argument("--provider-latency", type=float, default=0.0, help="Seconds the stub rate provider waits per call.")
+        parser.add_argument("--provider-error-rate", type=float, default=0.0)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Write the JSON report here instead of stdout.")
+        parser.add_argument("--compare", help="Baseline report; fail if any route regressed.")
+        parser.add_argument("--threshold", type=float, default=0.2, help="Allowed regression as a fraction (default 0.2).")
+
+    def log(self, message):
+        self.stderr.write(message)
+
+    def handle(self, *args, **options):
+        if options["database"] == settings.MONGO_DB_NAME:
+            raise CommandError("Refusing to benchmark against the application database.")
+        mongoengine.disconnect(alias="default")
+        mongoengine.connect(db=options["database"], host=settings.MONGO_HOST, alias="default")
+
+        stub = providers.StubServerProvider(latency=options["provider_latency"], error_rate=options["provider_error_rate"])
+        providers.use_provider(stub)
+        rate_cache.clear()
+        currency_registry.refresh()
+
+        meta = {
+            "commit": current_commit(),
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "invoices": options["invoices"],
+            "requests_per_route": options["requests"],
+            "concurrency": options["concurrency"],
+            "provider_latency": options["provider_latency"],
+            "provider_error_rate": options["provider_error_rate"],
+        }
+        if not options["skip_seed"]:
+            self.log(f"Seeding {options['invoices']:,} invoices into {options['database']}...")
+            started = time.perf_counter()
+            seed_invoices(options["invoices"], seed=options["seed"])
+            meta["seed_seconds"] = round(time.perf_counter() - started, 3)
+            meta["seed_docs_per_second"] = round(options["invoices"] / meta["seed_seconds"]) if meta["seed_seconds"] else None
+
+        sample_ids = [
+            doc["_id"]
+            for doc in Invoice._get_collection().aggregate([{"$sample": {"size": 1000}}, {"$project": {"_id": 1}}])
+        ]
+        if not sample_ids:
+            raise CommandError("The benchmark database is empty; run without --skip-seed.")
+
+        scenarios = build_scenarios(sample_ids)
+        if options["routes"]:
+            wanted = set(options["routes"].split(","))
+            unknown = wanted - {scenario.name for scenario in scenarios}
+            if unknown:
+                raise CommandError(f"Unknown route(s): {', '.join(sorted(unknown))}")
+            scenarios = [scenario for scenario in scenarios if scenario.name in wanted]
+
+        routes = {}
+        with override_settings(ALLOWED_HOSTS=["testserver"]):
+            for scenario in scenarios:
+                self.log(f"  {scenario.name}")
+                routes[scenario.name] = run_scenario(scenario, options["requests"], options["concurrency"], options["seed"])
+        meta["provider_calls"] = stub.server.requests
+        report = {"meta": meta, "routes": routes}
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                f.write(output + "\n")
+            self.log(f"Report written to {options['output']}")
+        else:
+            self.stdout.write(output)
+
+        if options["compare"]:
+            regressions = compare_reports(load_report(options["compare"]), report, options["threshold"])
+            for name, problems in regressions.items():
+                for metric, (before, now) in problems.items():
+                    self.log(self.style.ERROR(f"{name}: {metric} {before} -> {now}"))
+            if regressions:
+                raise CommandError(f"{len(regressions)} route(s) regressed by more than {options['threshold']:.0%}.")
+            self.log(self.style.SUCCESS("No regressions against the baseline."))
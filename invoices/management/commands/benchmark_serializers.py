@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from invoices.benchmarks import synthetic_documents
+from invoices.models import Invoice
+from invoices.serializers import InvoiceSerializer, render_invoice_document
+
+
+class Command(BaseCommand):
+    help = "Compare list serialization throughput: MongoEngine + InvoiceSerializer vs the raw-document fast path."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--documents", type=int, default=20000)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def _best_of(self, repeat, func):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def handle(self, *args, **options):
+        documents = list(synthetic_documents(options["documents"]))
+
+        def drf_path():
+            InvoiceSerializer([Invoice._from_son(doc) for doc in documents], many=True).data
+
+        def fast_path():
+            [render_invoice_document(doc) for doc in documents]
+
+        # Both paths must agree before their speed means anything.
+        sample = documents[:100]
+        expected = InvoiceSerializer([Invoice._from_son(doc) for doc in sample], many=True).data
+        if [render_invoice_document(doc) for doc in sample] != expected:
+            self.stderr.write(self.style.ERROR("Fast path output differs from InvoiceSerializer."))
+            return
+
+        drf = self._best_of(options["repeat"], drf_path)
+        fast = self._best_of(options["repeat"], fast_path)
+        count = len(documents)
+        self.stdout.write(f"MongoEngine + InvoiceSerializer: {count / drf:,.0f} docs/s")
+        self.stdout.write(f"as_pymongo + render_invoice_document: {count / fast:,.0f} docs/s")
+        self.stdout.write(self.style.SUCCESS(f"Speed-up: {drf / fast:.1f}x"))
@@ -0,0 +1,205 @@
+import csv
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from invoices.bulk import RateResolver, insert_invoice_documents, prepare_invoice
+from invoices.filters import FilterError, parse_datetime_param
+from invoices.utils import get_supported_currencies
+
+
+class MalformedRow:
+    """Stands in for a line that could not be parsed, so it is counted as
+    invalid at its offset instead of stopping the import."""
+
+    def __init__(self, errors):
+        self.errors = errors
+
+
+def read_rows(path, fmt):
+    """Yield (offset, row) pairs without loading the file into memory."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            reader = iter(csv.DictReader(f))
+            offset = 0
+            while True:
+                try:
+                    row = next(reader)
+                except StopIteration:
+                    return
+                except csv.Error as e:
+                    row = MalformedRow({"row": f"Invalid CSV: {e}."})
+                yield offset, row
+                offset += 1
+        else:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    try:
+                        row = json.loads(line)
+                    except json.JSONDecodeError as e:
+                        row = MalformedRow({"row": f"Invalid JSON: {e.msg} at column {e.colno}."})
+                    yield offset, row
+                    offset += 1
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+class Checkpoint:
+    """Tracks the highest offset below which every row has been written.
+
+    Batches finish out of order in the thread pool, so the saved offset only
+    advances over a contiguous run of completed batches.
+    """
+
+    def __init__(self, path, offset=0):
+        self.path = path
+        self.offset = offset
+        self._done = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        if path and os.path.exists(path):
+            with open(path) as f:
+                return cls(path, int(f.read().strip() or 0))
+        return cls(path)
+
+    def complete(self, start, end):
+        with self._lock:
+            self._done[start] = end
+            advanced = False
+            while self.offset in self._done:
+                self.offset = self._done.pop(self.offset)
+                advanced = True
+            if advanced and self.path:
+                tmp = f"{self.path}.tmp"
+                with open(tmp, "w") as f:
+                    f.write(str(self.offset))
+                os.replace(tmp, self.path)
+
+
+class Command(BaseCommand):
+    help = "Stream invoices from a CSV or NDJSON file into MongoDB in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=["csv", "ndjson"], help="Defaults to the file extension.")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument(
+            "--max-pending",
+            type=int,
+            default=8,
+            help="Batches allowed in flight before reading pauses.",
+        )
+        parser.add_argument("--checkpoint", help="File recording the offset of the last contiguous written row.")
+        parser.add_argument("--resume", action="store_true", help="Skip rows before the checkpoint offset.")
+        parser.add_argument("--progress-every", type=int, default=10000)
+
+    def _build_document(self, row, supported_currencies, resolve_rate):
+        if isinstance(row, MalformedRow):
+            return None, row.errors
+        document, errors = prepare_invoice(row, supported_currencies, resolve_rate)
+        if errors:
+            return None, errors
+        # Historical rows may carry their original rate and timestamp.
+        if row.get("exchange_rate") not in (None, ""):
+            try:
+                exchange_rate = float(row["exchange_rate"])
+            except (TypeError, ValueError):
+                return None, {"exchange_rate": "A valid number is required."}
+            # NaN or inf would poison every revenue counter it reaches.
+            if not math.isfinite(exchange_rate) or exchange_rate <= 0:
+                return None, {"exchange_rate": "A finite number greater than zero is required."}
+            document["exchange_rate"] = exchange_rate
+            document["converted_amount"] = document["amount"] * document["exchange_rate"]
+        try:
+            created_at = parse_datetime_param(row, "created_at")
+        except FilterError as e:
+            return None, {e.param: e.message}
+        if created_at:
+            document["created_at"] = created_at
+        return document, None
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or os.path.splitext(path)[1].lstrip(".").lower()
+        if fmt not in ("csv", "ndjson", "jsonl"):
+            raise CommandError("Cannot infer the file format; pass --format csv or --format ndjson.")
+        fmt = "csv" if fmt == "csv" else "ndjson"
+
+        checkpoint = Checkpoint.load(options["checkpoint"]) if options["resume"] else Checkpoint(options["checkpoint"])
+        start_offset = checkpoint.offset
+        try:
+            supported_currencies = get_supported_currencies()
+        except Exception as e:
+            raise CommandError(f"Unable to retrieve supported currencies: {e}")
+        resolve_rate = RateResolver()
+
+        stats = {"read": 0, "inserted": 0, "invalid": 0, "failed": 0}
+        stats_lock = threading.Lock()
+        pending = threading.BoundedSemaphore(options["max_pending"])
+        started = time.perf_counter()
+        next_report = options["progress_every"]
+
+        def write_batch(start, end, documents):
+            try:
+                failed = insert_invoice_documents(documents) if documents else {}
+                with stats_lock:
+                    stats["inserted"] += len(documents) - len(failed)
+                    stats["failed"] += len(failed)
+                checkpoint.complete(start, end)
+            finally:
+                pending.release()
+
+        rows = ((offset, row) for offset, row in read_rows(path, fmt) if offset >= start_offset)
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            futures = []
+            for batch in batched(rows, options["batch_size"]):
+                documents = []
+                for offset, row in batch:
+                    document, errors = self._build_document(row, supported_currencies, resolve_rate)
+                    if errors:
+                        stats["invalid"] += 1
+                        self.stderr.write(f"row {offset}: {json.dumps(errors, default=str)}")
+                    else:
+                        documents.append(document)
+                stats["read"] += len(batch)
+                # Blocks once --max-pending batches are queued, so reading
+                # never runs ahead of what MongoDB can absorb.
+                pending.acquire()
+                futures.append(pool.submit(write_batch, batch[0][0], batch[-1][0] + 1, documents))
+                finished = {future for future in futures if future.done()}
+                for future in finished:
+                    future.result()  # surface write errors as soon as they happen
+                futures = [future for future in futures if future not in finished]
+
+                if stats["read"] >= next_report:
+                    next_report += options["progress_every"]
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(
+                        f"{stats['read']} rows read, {stats['inserted']} inserted "
+                        f"({stats['read'] / elapsed:,.0f} rows/s), offset {checkpoint.offset}"
+                    )
+            for future in futures:
+                future.result()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {stats['inserted']} invoices from {stats['read']} rows in {elapsed:.1f}s "
+                f"({stats['read'] / elapsed if elapsed else 0:,.0f} rows/s); "
+                f"{stats['invalid']} invalid, {stats['failed']} failed to write. Checkpoint offset {checkpoint.offset}."
+            )
+        )
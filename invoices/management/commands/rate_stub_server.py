@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from invoices.providers import StaticFileProvider
+from invoices.stub_server import StubRateServer
+
+
+class Command(BaseCommand):
+    help = "Serve exchange rates from a local stub in the provider's API format, for load tests."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--file", help="JSON rate file (default: the bundled sample rates).")
+        parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response.")
+        parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many extra seconds, at random.")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests to fail.")
+        parser.add_argument("--error-status", type=int, default=503)
+
+    def handle(self, *args, **options):
+        server = StubRateServer(
+            StaticFileProvider(options["file"]),
+            host=options["host"],
+            port=options["port"],
+            latency=options["latency"],
+            jitter=options["jitter"],
+            error_rate=options["error_rate"],
+            error_status=options["error_status"],
+        ).start()
+        self.stdout.write(f"Serving rates at {server.base_url}; Ctrl-C to stop.")
+        self.stdout.write(
+            'Point the app at it with EXCHANGE_RATE_PROVIDER = {"BACKEND": "invoices.providers.HTTPProvider", '
+            f'"OPTIONS": {{"base_url": "{server.base_url}"}}}}'
+        )
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            server.stop()
+            self.stdout.write(f"Served {server.requests} request(s), {server.errors} injected error(s).")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from invoices.sketches import rebuild_quantile_sketches
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-currency quantile sketches from the invoice collection, clearing accumulated deletes."
+
+    def handle(self, *args, **options):
+        written = rebuild_quantile_sketches()
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} quantile sketch(es)."))
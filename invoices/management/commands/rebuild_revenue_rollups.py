@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from invoices.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily/weekly/monthly revenue rollups from the invoice collection."
+
+    def handle(self, *args, **options):
+        written = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} rollup document(s)."))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from invoices.counters import clear_counters_dirty, compute_counters, counter_drift, replace_counters, stored_counters
+
+
+class Command(BaseCommand):
+    help = "Rebuild the revenue counters from the invoice collection and report any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Report drift without rewriting the counters.")
+
+    def handle(self, *args, **options):
+        expected = compute_counters()
+        drift = counter_drift(expected, stored_counters())
+        for key, fields in drift.items():
+            details = ", ".join(f"{field} {delta:+g}" for field, delta in fields.items())
+            self.stdout.write(f"{key}: {details}")
+        if not drift:
+            clear_counters_dirty()
+            self.stdout.write(self.style.SUCCESS("Revenue counters match the invoice collection."))
+            return
+        if options["dry_run"]:
+            self.stdout.write(self.style.WARNING(f"{len(drift)} counter(s) drifted; run without --dry-run to fix."))
+            return
+        replace_counters(expected)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(expected)} counter(s); {len(drift)} had drifted."))
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from invoices.refresher import rate_refresher
+
+
+class Command(BaseCommand):
+    help = "Keep the stored exchange-rate snapshot fresh, refreshing on a jittered interval."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Run a single refresh and exit.")
+        parser.add_argument("--interval", type=float, help="Seconds between refreshes (default: settings).")
+
+    def handle(self, *args, **options):
+        if options["interval"]:
+            rate_refresher.interval = options["interval"]
+        if options["once"]:
+            rate_refresher.refresh_once()
+            self.report()
+            return
+        self.stdout.write(f"Refreshing rates about every {rate_refresher.interval:g}s; Ctrl-C to stop.")
+        rate_refresher.start()
+        runs = 0
+        try:
+            while rate_refresher.running:
+                time.sleep(1)
+                if rate_refresher.runs != runs:
+                    runs = rate_refresher.runs
+                    self.report()
+        except KeyboardInterrupt:
+            rate_refresher.stop()
+
+    def report(self):
+        status = rate_refresher.status()
+        if status["last_error"]:
+            self.stdout.write(self.style.WARNING(f"Refresh failed after {status['last_duration']:.3f}s: {status['last_error']}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Rates refreshed in {status['last_duration']:.3f}s."))
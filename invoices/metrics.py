@@ -0,0 +1,207 @@
+# invoices/metrics.py
+
+import threading
+from bisect import bisect_left
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram; an observation is one bisect and a few
+    increments under a lock."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket (non-cumulative) counts, then sum.
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, (list(counts), total)) for key, (counts, total) in self._series.items())
+        for key, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = (("le", _number(bound)),)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Metrics rendered in the Prometheus text exposition format.
+
+    Collectors are callables run at scrape time that return
+    (name, type, documentation, [(labels_dict, value), ...]) tuples, for
+    numbers that are already counted elsewhere (e.g. cache hits).
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        self._collectors.append(collector)
+        return collector
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, kind, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_DURATION = registry.histogram(
+    "invoices_http_request_duration_seconds",
+    "Time spent handling a request, by view.",
+    ("view", "method", "status"),
+)
+MONGO_COMMAND_DURATION = registry.histogram(
+    "invoices_mongodb_command_duration_seconds",
+    "MongoDB command round-trip time, by command.",
+    ("command",),
+)
+MONGO_COMMAND_FAILURES = registry.counter(
+    "invoices_mongodb_command_failures_total",
+    "MongoDB commands that failed, by command.",
+    ("command",),
+)
+PROVIDER_REQUEST_DURATION = registry.histogram(
+    "invoices_provider_request_duration_seconds",
+    "Outbound exchange-rate provider calls, by provider base URL and outcome.",
+    ("base_url", "outcome"),
+)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Feeds the driver's own per-command timing into the histogram."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, command=event.command_name)
+
+    def failed(self, event):
+        MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, command=event.command_name)
+        MONGO_COMMAND_FAILURES.inc(command=event.command_name)
+
+
+mongo_command_listener = MongoCommandListener()
+
+
+def _view_name(request):
+    match = getattr(request, "resolver_match", None)
+    return match.view_name if match else "<unresolved>"
+
+
+def _record(request, started, status):
+    REQUEST_DURATION.observe(perf_counter() - started, view=_view_name(request), method=request.method, status=status)
+
+
+@sync_and_async_middleware
+def MetricsMiddleware(get_response):
+    """Times every request and records it under the resolved view name; a
+    request whose handler raises is recorded as a 500."""
+
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            started = perf_counter()
+            try:
+                response = await get_response(request)
+            except Exception:
+                _record(request, started, 500)
+                raise
+            _record(request, started, response.status_code)
+            return response
+
+    else:
+
+        def middleware(request):
+            started = perf_counter()
+            try:
+                response = get_response(request)
+            except Exception:
+                _record(request, started, 500)
+                raise
+            _record(request, started, response.status_code)
+            return response
+
+    return middleware
@@ -1,10 +1,38 @@
 # invoices/models.py
 
 import mongoengine as me
-import requests
-from invoices_api import settings
 from datetime import datetime
 
+from . import events
+
+
+def utcnow_millis():
+    # MongoDB keeps millisecond precision; truncating up front keeps the
+    # returned representation identical to what is stored.
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+class InvoiceQuerySet(me.QuerySet):
+    DELETE_BATCH_SIZE = 1000
+
+    def delete(self, *args, **kwargs):
+        if (self._skip or self._limit) and not kwargs.get("_from_doc_delete"):
+            # MongoEngine falls back to deleting document by document, and
+            # each of those comes back through here.
+            return super().delete(*args, **kwargs)
+        # Read a batch of matches, then delete exactly those _ids, so the
+        # documents reported are the ones removed (an invoice inserted
+        # meanwhile is picked up by a later batch) and memory stays bounded.
+        deleted = 0
+        while True:
+            removed = list(self.clone().only(*events.CHANGE_FIELDS).limit(self.DELETE_BATCH_SIZE).as_pymongo())
+            if not removed:
+                return deleted
+            by_id = self._document.objects(id__in=[doc["_id"] for doc in removed])
+            deleted += super(InvoiceQuerySet, by_id).delete(*args, **kwargs)
+            events.invoices_deleted(removed)
+
 
 class Invoice(me.Document):
     amount = me.FloatField(required=True)
@@ -12,26 +40,127 @@ class Invoice(me.Document):
     converted_amount = me.FloatField(default=0)
     exchange_rate = me.FloatField(default=1.0)
     created_at = me.DateTimeField(default=datetime.utcnow)
+    # Bumped on every save; validators for ETag / Last-Modified.
+    version = me.IntField(default=1)
+    updated_at = me.DateTimeField()
+
+    meta = {
+        "queryset_class": InvoiceQuerySet,
+        "indexes": [
+            # keyset pagination order, see invoices/pagination.py; also
+            # serves created_at ranges
+            ("created_at", "id"),
+            # currency filter (+ date range) in list order
+            ("currency", "created_at", "id"),
+            # amount ranges, alone or within a currency
+            "amount",
+            ("currency", "amount"),
+            # min/max for the counter-backed analytics
+            "converted_amount",
+            ("currency", "converted_amount"),
+        ],
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Values as last stored, so an update can report what it replaced.
+        self._saved_state = None if self._created else self.change_state()
+
+    def change_state(self):
+        return {"_id": self.pk, **{name: self[name] for name in events.CHANGE_FIELDS}}
 
     def save(self, *args, **kwargs):
         if not self.converted_amount or not self.exchange_rate:
             self.converted_amount, self.exchange_rate = self.convert_to_usd()
         if not self.created_at:
             self.created_at = datetime.utcnow()
-        return super().save(*args, **kwargs)
+        if self._saved_state is not None:
+            self.version = (self.version or 1) + 1
+        self.updated_at = utcnow_millis()
+        result = super().save(*args, **kwargs)
+        previous, self._saved_state = self._saved_state, self.change_state()
+        if previous is None:
+            events.invoices_created([self._saved_state])
+        else:
+            events.invoice_updated(previous, self._saved_state)
+        return result
 
     def convert_to_usd(self):
-        base_url = settings.EXCHANGE_API_URL
-        api_key = settings.EXCHANGE_API_KEY
-        url = f"{base_url}/{api_key}/pair/{self.currency}/USD/{self.amount}"
-
-        try:
-            response = requests.get(url)
-            data = response.json()
-            if data.get("result") == "success":
-                return data.get("conversion_result", self.amount), data.get(
-                    "conversion_rate", 1.0
-                )
-        except Exception as e:
-            print("Currency API error:", e)
-        return self.amount, 1.0
+        """(converted_amount, exchange_rate) from the cached rate table, which
+        falls back to the latest snapshot. Raises RateUnavailable rather than
+        storing a made-up rate."""
+        # Imported here: rates keeps its snapshots in this module.
+        from .rates import rate_cache
+
+        rate = rate_cache.get_rate(self.currency, "USD")
+        return self.amount * rate, rate
+
+
+class RevenueCounter(me.Document):
+    """Running totals per currency, plus one global document under ALL_KEY."""
+
+    ALL_KEY = "*"
+
+    key = me.StringField(primary_key=True)
+    count = me.IntField(default=0)
+    sum_usd = me.FloatField(default=0)
+    sum_sq_usd = me.FloatField(default=0)
+    sum_amount = me.FloatField(default=0)
+    # Set on the ALL_KEY document when an update failed; cleared by
+    # reconcile_revenue_counters.
+    dirty = me.BooleanField(default=False)
+
+    meta = {"collection": "revenue_counters"}
+
+
+class RevenueRollup(me.Document):
+    """Invoice count and sums for one (granularity, bucket, currency) cell."""
+
+    GRANULARITIES = ("day", "week", "month")
+
+    granularity = me.StringField(required=True, choices=GRANULARITIES)
+    bucket = me.DateTimeField(required=True)
+    currency = me.StringField(max_length=10, required=True)
+    count = me.IntField(default=0)
+    sum_usd = me.FloatField(default=0)
+    sum_amount = me.FloatField(default=0)
+
+    meta = {
+        "collection": "revenue_rollups",
+        "indexes": [
+            {"fields": ["granularity", "bucket", "currency"], "unique": True},
+            ("granularity", "currency", "bucket"),
+        ],
+    }
+
+
+class QuantileSketch(me.Document):
+    """One shard of the KLL sketches of converted_amount for a currency (or
+    ALL_KEY): one of inserted values and one of deleted values, see
+    invoices/sketches.py."""
+
+    id = me.StringField(primary_key=True)  # "<key>#<shard>"
+    key = me.StringField(required=True)
+    shard = me.IntField(default=0)
+    version = me.IntField(default=0)
+    inserted = me.DictField()
+    deleted = me.DictField()
+    # Set when an update was dropped; cleared by rebuild_quantile_sketches.
+    stale = me.BooleanField(default=False)
+
+    meta = {"collection": "quantile_sketches", "indexes": ["key"]}
+
+
+class RateSnapshot(me.Document):
+    """Every rate table fetched from the provider, kept for offline and
+    historical conversions."""
+
+    base = me.StringField(max_length=10, required=True)
+    fetched_at = me.DateTimeField(required=True)
+    updated_at = me.DateTimeField()
+    rates = me.DictField(required=True)
+
+    meta = {
+        "collection": "rate_snapshots",
+        "indexes": [("base", "-fetched_at")],
+    }
@@ -0,0 +1,95 @@
+# invoices/pagination.py
+
+import base64
+import json
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from invoices_api import settings
+from .conditional import VALIDATOR_FIELDS
+from .models import Invoice
+from .serializers import INVOICE_DOCUMENT_FIELDS
+
+# What the list renders, plus what its ETag is built from.
+PAGE_FIELDS = tuple(dict.fromkeys((*INVOICE_DOCUMENT_FIELDS, *VALIDATOR_FIELDS)))
+
+
+class PaginationError(ValueError):
+    def __init__(self, param, message):
+        super().__init__(message)
+        self.param = param
+        self.message = message
+
+
+def encode_cursor(created_at, pk, direction):
+    payload = json.dumps({"c": created_at.isoformat(), "i": str(pk), "d": direction})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        direction = payload["d"]
+        if direction not in ("next", "prev"):
+            raise ValueError(direction)
+        return datetime.fromisoformat(payload["c"]), ObjectId(payload["i"]), direction
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise PaginationError("cursor", "Invalid cursor.") from None
+
+
+def parse_limit(params):
+    value = params.get("limit")
+    if not value:
+        return settings.INVOICE_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        raise PaginationError("limit", "limit must be a positive integer.")
+    return min(limit, settings.INVOICE_MAX_PAGE_SIZE)
+
+
+def keyset_page(match, cursor=None, limit=50):
+    """Return one page of raw invoice documents ordered by (created_at, id)
+    plus opaque next/previous cursors.
+
+    Pages are located with a range condition on the (created_at, _id) index
+    rather than skip(), so every page costs the same to fetch.
+    """
+    query = dict(match)
+    direction = "next"
+    ordering = ("created_at", "id")
+    if cursor:
+        created_at, pk, direction = decode_cursor(cursor)
+        op = "$gt" if direction == "next" else "$lt"
+        query["$or"] = [
+            {"created_at": {op: created_at}},
+            {"created_at": created_at, "_id": {op: pk}},
+        ]
+        if direction == "prev":
+            ordering = ("-created_at", "-id")
+
+    items = list(
+        Invoice.objects(__raw__=query)
+        .order_by(*ordering)
+        .limit(limit + 1)
+        .only(*PAGE_FIELDS)
+        .as_pymongo()
+    )
+    has_more = len(items) > limit
+    items = items[:limit]
+    if direction == "prev":
+        items.reverse()
+
+    has_next = has_more if direction == "next" else bool(cursor)
+    has_previous = has_more if direction == "prev" else bool(cursor)
+    next_cursor = previous_cursor = None
+    if items and has_next:
+        next_cursor = encode_cursor(items[-1]["created_at"], items[-1]["_id"], "next")
+    if items and has_previous:
+        previous_cursor = encode_cursor(items[0]["created_at"], items[0]["_id"], "prev")
+    return items, next_cursor, previous_cursor
@@ -0,0 +1,183 @@
+# invoices/providers.py
+
+import asyncio
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.utils.module_loading import import_string
+
+from invoices_api import settings
+from .http import build_provider_client, provider_client
+from .stub_server import StubRateServer
+
+SAMPLE_RATES_FILE = Path(__file__).resolve().parent / "data" / "sample_rates.json"
+
+
+class ProviderError(Exception):
+    pass
+
+
+class RateProvider(ABC):
+    """Where exchange rates come from.
+
+    `latest(base)` returns `(rates, updated_at)`, where rates[X] is the number
+    of X units per unit of `base`; `supported_codes()` maps code to name;
+    `pair()` converts a single amount. The async variants default to running
+    the sync call in a thread. A backend missing `latest` or
+    `supported_codes` cannot be instantiated, so it fails at settings load.
+    """
+
+    @abstractmethod
+    def latest(self, base):
+        ...
+
+    @abstractmethod
+    def supported_codes(self):
+        ...
+
+    def pair(self, from_currency, to_currency, amount):
+        rates, _ = self.latest(from_currency)
+        try:
+            rate = rates[to_currency]
+        except KeyError:
+            raise ProviderError(f"No rate for currency {to_currency!r}") from None
+        return amount * rate, rate
+
+    async def alatest(self, base):
+        return await asyncio.to_thread(self.latest, base)
+
+    async def asupported_codes(self):
+        return await asyncio.to_thread(self.supported_codes)
+
+
+def _unix_time(value):
+    return datetime.fromtimestamp(value, timezone.utc) if value is not None else None
+
+
+class HTTPProvider(RateProvider):
+    """The exchangerate-api.com v6 API, or anything speaking its format."""
+
+    def __init__(self, base_url=None, api_key=None, client=None):
+        if client is None and (base_url or api_key):
+            client = build_provider_client(base_url, api_key)
+        self._client = client or provider_client
+
+    @property
+    def client(self):
+        return self._client
+
+    @staticmethod
+    def _latest(data):
+        return data["conversion_rates"], _unix_time(data.get("time_last_update_unix"))
+
+    @staticmethod
+    def _codes(data):
+        # data['supported_codes'] is a list like [['USD', 'United States Dollar'], ...]
+        return {code: name for code, name in data["supported_codes"]}
+
+    def latest(self, base):
+        return self._latest(self.client.get_json("latest", base))
+
+    async def alatest(self, base):
+        return self._latest(await self.client.aget_json("latest", base))
+
+    def supported_codes(self):
+        return self._codes(self.client.get_json("codes"))
+
+    async def asupported_codes(self):
+        return self._codes(await self.client.aget_json("codes"))
+
+    def pair(self, from_currency, to_currency, amount):
+        data = self.client.get_json("pair", from_currency, to_currency, amount)
+        if data.get("result") != "success":
+            raise ProviderError(data.get("error-type", "Pair conversion failed"))
+        return data["conversion_result"], data["conversion_rate"]
+
+
+class StaticFileProvider(RateProvider):
+    """Rates from a JSON file, re-read whenever the file changes.
+
+    The file holds one table: {"base": "USD", "updated_at": <unix time>,
+    "rates": {"EUR": 0.88, ...}, "names": {"EUR": "Euro", ...}}. Tables for
+    other bases are derived from it.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path or SAMPLE_RATES_FILE)
+        self._mtime = None
+        self._data = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        mtime = os.stat(self.path).st_mtime
+        with self._lock:
+            if mtime != self._mtime:
+                with open(self.path, encoding="utf-8") as f:
+                    self._data = json.load(f)
+                self._mtime = mtime
+            return self._data
+
+    def latest(self, base):
+        data = self._load()
+        rates = data["rates"]
+        if not rates.get(base):
+            raise ProviderError(f"Unsupported base currency {base!r}")
+        per_base = rates[base]
+        return {code: rate / per_base for code, rate in rates.items()}, _unix_time(data.get("updated_at"))
+
+    def supported_codes(self):
+        data = self._load()
+        names = data.get("names", {})
+        return {code: names.get(code, code) for code in data["rates"]}
+
+
+class StubServerProvider(HTTPProvider):
+    """Talks HTTP to a local stub server started on first use.
+
+    The stub serves a static rate file with configurable latency and error
+    injection, so load tests exercise the real client path (pooling,
+    retries, circuit breaker) without calling the paid API.
+    """
+
+    def __init__(self, path=None, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503):
+        self._client = None
+        self.server = StubRateServer(
+            StaticFileProvider(path),
+            host=host,
+            port=port,
+            latency=latency,
+            jitter=jitter,
+            error_rate=error_rate,
+            error_status=error_status,
+        )
+        self._start_lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._start_lock:
+                if self._client is None:
+                    self.server.start()
+                    self._client = build_provider_client(self.server.base_url, "stub")
+        return self._client
+
+
+def load_provider(config):
+    """Instantiate the backend named by a {"BACKEND": ..., "OPTIONS": {...}} dict."""
+    backend = import_string(config["BACKEND"])
+    return backend(**config.get("OPTIONS", {}))
+
+
+rate_provider = load_provider(settings.EXCHANGE_RATE_PROVIDER)
+
+
+def use_provider(provider):
+    """Swap the active backend at runtime (e.g. for benchmarks); returns the
+    previous one."""
+    global rate_provider
+    previous, rate_provider = rate_provider, provider
+    return previous
@@ -0,0 +1,271 @@
+# invoices/rates.py
+
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from invoices_api import settings
+from .models import RateSnapshot
+from . import providers
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class RateUnavailable(Exception):
+    pass
+
+
+class RateTable:
+    """Conversion rates quoted against a single base currency."""
+
+    def __init__(self, base, rates, fetched_at=None, updated_at=None):
+        self.base = base
+        self.rates = rates
+        self.fetched_at = fetched_at or datetime.now(timezone.utc)
+        # When the provider last updated the rates, as opposed to when we fetched them.
+        self.updated_at = updated_at or self.fetched_at
+
+    def rate(self, from_currency, to_currency):
+        # rates[X] is the number of X units for one unit of the base currency,
+        # so any pair can be derived from the single table.
+        try:
+            from_rate = self.rates[from_currency]
+            to_rate = self.rates[to_currency]
+        except KeyError as e:
+            raise RateUnavailable(f"No rate for currency {e.args[0]!r}") from None
+        if not from_rate:
+            raise RateUnavailable(f"No rate for currency {from_currency!r}")
+        return to_rate / from_rate
+
+
+def fetch_rate_table(base):
+    rates, updated_at = providers.rate_provider.latest(base)
+    return RateTable(base, rates, updated_at=updated_at)
+
+
+async def afetch_rate_table(base):
+    rates, updated_at = await providers.rate_provider.alatest(base)
+    return RateTable(base, rates, updated_at=updated_at)
+
+
+def _aware(value):
+    # MongoDB hands datetimes back as naive UTC.
+    return value.replace(tzinfo=timezone.utc) if value and value.tzinfo is None else value
+
+
+def save_snapshot(table):
+    RateSnapshot._get_collection().insert_one(
+        {
+            "base": table.base,
+            "fetched_at": table.fetched_at,
+            "updated_at": table.updated_at,
+            "rates": table.rates,
+        }
+    )
+    prune_snapshots(table.base)
+
+
+def prune_snapshots(base, keep_days=None):
+    """Keep every snapshot of the last `keep_days` days and only the newest
+    of each earlier UTC day, which is all a `rates_as_of` lookup needs.
+
+    Older days are already down to one document each, so every pass scans
+    about one per day of history. Returns the number deleted.
+    """
+    keep_days = settings.EXCHANGE_RATE_SNAPSHOT_KEEP_DAYS if keep_days is None else keep_days
+    cutoff = datetime.now(timezone.utc) - timedelta(days=keep_days)
+    older = {"base": base, "fetched_at": {"$lt": cutoff}}
+    collection = RateSnapshot._get_collection()
+    pipeline = [
+        {"$match": older},
+        {"$sort": {"fetched_at": -1}},
+        {"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$fetched_at"}}, "keep": {"$first": "$_id"}}},
+    ]
+    keep = [row["keep"] for row in collection.aggregate(pipeline)]
+    return collection.delete_many({**older, "_id": {"$nin": keep}}).deleted_count
+
+
+def latest_snapshot(base, as_of=None):
+    """The newest stored table for `base`, optionally fetched before `as_of`."""
+    query = {"base": base}
+    if as_of is not None:
+        query["fetched_at"] = {"$lt": as_of}
+    doc = RateSnapshot._get_collection().find_one(query, sort=[("fetched_at", -1)])
+    if doc is None:
+        return None
+    return RateTable(doc["base"], doc["rates"], _aware(doc["fetched_at"]), _aware(doc.get("updated_at")))
+
+
+def _fresh(snapshot, ttl):
+    return snapshot is not None and datetime.now(timezone.utc) - snapshot.fetched_at < timedelta(seconds=ttl)
+
+
+def load_rate_table(base, ttl=None):
+    """Fetch path behind the rate cache.
+
+    A snapshot younger than the TTL (e.g. stored by another process) is used
+    as is; otherwise the provider is asked and the answer stored. If the
+    provider is down, the newest snapshot is served, however old.
+    """
+    ttl = settings.EXCHANGE_RATE_CACHE_TTL if ttl is None else ttl
+    snapshot = latest_snapshot(base)
+    if _fresh(snapshot, ttl):
+        return snapshot
+    try:
+        table = fetch_rate_table(base)
+    except Exception:
+        if snapshot is None:
+            raise
+        logger.warning("Rate provider unavailable; serving %s rates from %s", base, snapshot.fetched_at)
+        return snapshot
+    save_snapshot(table)
+    return table
+
+
+async def aload_rate_table(base, ttl=None):
+    ttl = settings.EXCHANGE_RATE_CACHE_TTL if ttl is None else ttl
+    snapshot = await asyncio.to_thread(latest_snapshot, base)
+    if _fresh(snapshot, ttl):
+        return snapshot
+    try:
+        table = await afetch_rate_table(base)
+    except Exception:
+        if snapshot is None:
+            raise
+        logger.warning("Rate provider unavailable; serving %s rates from %s", base, snapshot.fetched_at)
+        return snapshot
+    await asyncio.to_thread(save_snapshot, table)
+    return table
+
+
+class RateTableCache:
+    """TTL cache of rate tables keyed by base currency, with LRU eviction."""
+
+    def __init__(
+        self,
+        fetch=fetch_rate_table,
+        ttl=300,
+        max_entries=32,
+        base_currency="USD",
+        afetch=afetch_rate_table,
+    ):
+        self.fetch = fetch
+        self.afetch = afetch
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.base_currency = base_currency
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._inflight = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def _lookup(self, base):
+        with self._lock:
+            entry = self._entries.get(base)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, table = entry
+            if expires_at <= time.monotonic():
+                del self._entries[base]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(base)
+            self.hits += 1
+            return table
+
+    def store(self, table):
+        with self._lock:
+            self._entries[table.base] = (time.monotonic() + self.ttl, table)
+            self._entries.move_to_end(table.base)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_table(self, base=None):
+        base = base or self.base_currency
+        table = self._lookup(base)
+        if table is not None:
+            return table
+        # Only one thread refreshes a given table; the others wait for it
+        # instead of all hitting the provider at once.
+        with self._fetch_lock:
+            with self._lock:
+                entry = self._entries.get(base)
+                if entry is not None and entry[0] > time.monotonic():
+                    return entry[1]
+            table = self.fetch(base)
+            self.store(table)
+            return table
+
+    async def aget_table(self, base=None):
+        base = base or self.base_currency
+        table = self._lookup(base)
+        if table is not None:
+            return table
+        # Coroutines on the same loop that miss together share one fetch.
+        inflight = self._inflight.setdefault(asyncio.get_running_loop(), {})
+        task = inflight.get(base)
+        if task is None:
+            task = asyncio.ensure_future(self.afetch(base))
+            inflight[base] = task
+            task.add_done_callback(lambda _: inflight.pop(base, None))
+        table = await asyncio.shield(task)
+        self.store(table)
+        return table
+
+    def get_rate(self, from_currency, to_currency="USD"):
+        if from_currency == to_currency:
+            return 1.0
+        return self.get_table().rate(from_currency, to_currency)
+
+    async def aget_rate(self, from_currency, to_currency="USD"):
+        if from_currency == to_currency:
+            return 1.0
+        return (await self.aget_table()).rate(from_currency, to_currency)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+rate_cache = RateTableCache(
+    fetch=load_rate_table,
+    afetch=aload_rate_table,
+    ttl=settings.EXCHANGE_RATE_CACHE_TTL,
+    max_entries=settings.EXCHANGE_RATE_CACHE_MAX_ENTRIES,
+    base_currency=settings.EXCHANGE_RATE_BASE_CURRENCY,
+)
+
+
+@registry.register_collector
+def rate_cache_metrics():
+    stats = rate_cache.stats()
+    return [
+        ("invoices_rate_cache_hits_total", "counter", "Rate table lookups served from the cache.", [({}, stats["hits"])]),
+        ("invoices_rate_cache_misses_total", "counter", "Rate table lookups that had to load a table.", [({}, stats["misses"])]),
+        ("invoices_rate_cache_evictions_total", "counter", "Rate tables evicted to stay under the size limit.", [({}, stats["evictions"])]),
+        ("invoices_rate_cache_entries", "gauge", "Rate tables currently cached.", [({}, stats["size"])]),
+    ]
@@ -0,0 +1,131 @@
+# invoices/refresher.py
+
+import logging
+import random
+import threading
+import time
+
+from invoices_api import settings
+from .currencies import currency_registry
+from . import metrics
+from .rates import load_rate_table, rate_cache
+
+logger = logging.getLogger(__name__)
+
+
+class RateRefresher:
+    """Reloads the rate table and currency codes ahead of cache expiry.
+
+    Each run fetches a new table into the rate cache and refreshes the
+    currency registry, so request-path lookups find a warm entry. Runs are
+    spaced by a jittered interval, so workers started together do not hit
+    the provider in step. A run that starts while another is still going is
+    skipped.
+    """
+
+    def __init__(
+        self,
+        cache=rate_cache,
+        registry=currency_registry,
+        load=load_rate_table,
+        interval=240,
+        jitter=0.1,
+    ):
+        self.cache = cache
+        self.registry = registry
+        self.load = load
+        self.interval = interval
+        self.jitter = jitter
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_refresh = None
+        self.last_duration = None
+        self.last_error = None
+
+    def next_delay(self):
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def refresh_once(self):
+        """Run one refresh; returns False if another run was already going."""
+        if not self._run_lock.acquire(blocking=False):
+            self.skipped += 1
+            return False
+        started = time.perf_counter()
+        try:
+            # Accept a snapshot another process stored moments ago rather
+            # than having every worker call the provider.
+            table = self.load(self.cache.base_currency, ttl=self.interval / 2)
+            self.cache.store(table)
+            self.registry.refresh()
+        except Exception as e:
+            self.failures += 1
+            self.last_error = e
+            logger.warning("Rate refresh failed: %s", e)
+        else:
+            self.last_error = None
+            self.last_refresh = time.time()
+        finally:
+            self.runs += 1
+            self.last_duration = time.perf_counter() - started
+            self._run_lock.release()
+        return True
+
+    def run(self):
+        self.refresh_once()
+        while not self._stop.wait(self.next_delay()):
+            self.refresh_once()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="rate-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def status(self):
+        return {
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "last_refresh": self.last_refresh,
+            "last_duration": self.last_duration,
+            "last_error": str(self.last_error) if self.last_error else None,
+        }
+
+
+rate_refresher = RateRefresher(
+    interval=settings.EXCHANGE_RATE_REFRESH_INTERVAL,
+    jitter=settings.EXCHANGE_RATE_REFRESH_JITTER,
+)
+
+
+@metrics.registry.register_collector
+def refresher_metrics():
+    status = rate_refresher.status()
+
+    def sample(value):
+        # No sample until the first run sets the value.
+        return [({}, value)] if value is not None else []
+
+    return [
+        ("invoices_rate_refresher_running", "gauge", "1 while the background rate refresher thread is alive.", [({}, int(status["running"]))]),
+        ("invoices_rate_refresher_runs_total", "counter", "Rate refresh runs, successful or not.", [({}, status["runs"])]),
+        ("invoices_rate_refresher_failures_total", "counter", "Rate refresh runs that failed.", [({}, status["failures"])]),
+        ("invoices_rate_refresher_last_refresh_timestamp_seconds", "gauge", "Unix time of the last successful refresh.", sample(status["last_refresh"])),
+        ("invoices_rate_refresher_last_duration_seconds", "gauge", "How long the last refresh run took.", sample(status["last_duration"])),
+        ("invoices_rate_refresher_last_run_failed", "gauge", "1 if the last refresh run failed.", [({}, int(status["last_error"] is not None))]),
+    ]
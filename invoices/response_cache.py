@@ -0,0 +1,89 @@
+# invoices/response_cache.py
+
+import functools
+import hashlib
+
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+
+from invoices_api import settings
+from . import events
+from .metrics import registry
+
+DATA_VERSION_KEY = "invoices:data-version"
+
+CACHE_LOOKUPS = registry.counter(
+    "invoices_analytics_cache_lookups_total",
+    "Analytics response cache lookups, by view and result.",
+    ("view", "result"),
+)
+
+
+def _cache():
+    return caches[settings.ANALYTICS_CACHE_ALIAS]
+
+
+def data_version():
+    # The counter never expires; entries keyed by an old version simply age out.
+    cache = _cache()
+    version = cache.get(DATA_VERSION_KEY)
+    if version is None:
+        cache.add(DATA_VERSION_KEY, 1, timeout=None)
+        version = cache.get(DATA_VERSION_KEY, 1)
+    return version
+
+
+def bump_data_version():
+    cache = _cache()
+    try:
+        return cache.incr(DATA_VERSION_KEY)
+    except ValueError:
+        cache.add(DATA_VERSION_KEY, 2, timeout=None)
+        return cache.get(DATA_VERSION_KEY, 2)
+
+
+@events.on_change
+def invalidate_analytics(created, deleted):
+    # Registered after the counter/rollup handlers, so a reader that sees the
+    # new version also sees the data it describes.
+    bump_data_version()
+
+
+def response_cache_key(name, params, version):
+    query = "&".join(f"{key}={value}" for key, values in sorted(params.lists()) for value in values)
+    digest = hashlib.md5(query.encode(), usedforsecurity=False).hexdigest()
+    return f"invoices:analytics:{name}:v{version}:{digest}"
+
+
+def cache_analytics(name):
+    """Cache a view's successful GET responses until the next invoice write.
+
+    The key covers the endpoint, every query parameter and the data version,
+    so entries never need deleting; `ANALYTICS_CACHE_TIMEOUT` bounds how
+    stale the exchange rate baked into a cached answer can get.
+    """
+
+    def decorator(get):
+        @functools.wraps(get)
+        def wrapper(self, request, *args, **kwargs):
+            cache = _cache()
+            # Read the version before computing, so an answer built while a
+            # write lands is filed under the version it may predate.
+            key = response_cache_key(name, request.query_params, data_version())
+            data = cache.get(key)
+            if data is not None:
+                CACHE_LOOKUPS.inc(view=name, result="hit")
+                response = Response(data)
+                response["X-Cache"] = "HIT"
+                return response
+            CACHE_LOOKUPS.inc(view=name, result="miss")
+            response = get(self, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(key, response.data, timeout=settings.ANALYTICS_CACHE_TIMEOUT)
+            response["X-Cache"] = "MISS"
+            return response
+
+        return wrapper
+
+    return decorator
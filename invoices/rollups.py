@@ -0,0 +1,113 @@
+# invoices/rollups.py
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+from . import events
+from .models import Invoice, RevenueRollup
+
+
+def bucket_start(value, granularity):
+    day = datetime(value.year, value.month, value.day)
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())  # ISO weeks start on Monday
+    if granularity == "month":
+        return day.replace(day=1)
+    raise ValueError(f"Unknown granularity {granularity!r}")
+
+
+def rollup_deltas(created=(), deleted=()):
+    deltas = defaultdict(lambda: {"count": 0, "sum_usd": 0.0, "sum_amount": 0.0})
+    for documents, sign in ((created, 1), (deleted, -1)):
+        for doc in documents:
+            created_at = doc.get("created_at")
+            if created_at is None:
+                continue
+            for granularity in RevenueRollup.GRANULARITIES:
+                delta = deltas[(granularity, bucket_start(created_at, granularity), doc["currency"])]
+                delta["count"] += sign
+                delta["sum_usd"] += sign * (doc.get("converted_amount") or 0.0)
+                delta["sum_amount"] += sign * (doc.get("amount") or 0.0)
+    return deltas
+
+
+@events.on_change
+def update_revenue_rollups(created, deleted):
+    operations = [
+        UpdateOne(
+            {"granularity": granularity, "bucket": bucket, "currency": currency},
+            {"$inc": delta},
+            upsert=True,
+        )
+        for (granularity, bucket, currency), delta in rollup_deltas(created, deleted).items()
+    ]
+    if operations:
+        RevenueRollup._get_collection().bulk_write(operations, ordered=False)
+
+
+def revenue_series(granularity, start=None, end=None, currency=None):
+    """Per-bucket totals in USD for buckets overlapping [start, end).
+
+    Only rollup documents inside the range are read; the invoice collection
+    is not touched.
+    """
+    match = {"granularity": granularity, "count": {"$gt": 0}}
+    bucket = {}
+    if start:
+        bucket["$gte"] = bucket_start(start, granularity)
+    if end:
+        bucket["$lt"] = end
+    if bucket:
+        match["bucket"] = bucket
+    if currency:
+        match["currency"] = currency
+    pipeline = [
+        {"$match": match},
+        {"$group": {"_id": "$bucket", "count": {"$sum": "$count"}, "sum_usd": {"$sum": "$sum_usd"}}},
+        {"$sort": {"_id": 1}},
+    ]
+    return [
+        {"bucket": row["_id"], "count": row["count"], "sum_usd": row["sum_usd"]}
+        for row in RevenueRollup._get_collection().aggregate(pipeline)
+    ]
+
+
+def rebuild_rollups():
+    """Recompute every rollup from the invoice collection. Returns the number
+    of rollup documents written."""
+    documents = []
+    for granularity in RevenueRollup.GRANULARITIES:
+        truncate = {"date": "$created_at", "unit": granularity}
+        if granularity == "week":
+            truncate["startOfWeek"] = "monday"
+        pipeline = [
+            {"$match": {"created_at": {"$ne": None}}},
+            {
+                "$group": {
+                    "_id": {"bucket": {"$dateTrunc": truncate}, "currency": "$currency"},
+                    "count": {"$sum": 1},
+                    "sum_usd": {"$sum": "$converted_amount"},
+                    "sum_amount": {"$sum": "$amount"},
+                }
+            },
+        ]
+        for row in Invoice._get_collection().aggregate(pipeline, allowDiskUse=True):
+            documents.append(
+                {
+                    "granularity": granularity,
+                    "bucket": row["_id"]["bucket"],
+                    "currency": row["_id"]["currency"],
+                    "count": row["count"],
+                    "sum_usd": row["sum_usd"],
+                    "sum_amount": row["sum_amount"],
+                }
+            )
+    collection = RevenueRollup._get_collection()
+    collection.delete_many({})
+    if documents:
+        collection.insert_many(documents, ordered=False)
+    return len(documents)
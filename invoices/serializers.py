@@ -1,6 +1,12 @@
 # invoices/serializers.py
 
-from rest_framework import serializers
+from datetime import timezone
+
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+from invoices_api import settings
+from .models import Invoice
 
 
 class InvoiceSerializer(serializers.Serializer):
@@ -10,3 +16,64 @@ class InvoiceSerializer(serializers.Serializer):
     converted_amount = serializers.FloatField(read_only=True)
     exchange_rate = serializers.FloatField(read_only=True)
     created_at = serializers.DateTimeField(read_only=True)
+
+
+def _utc_isoformat(value):
+    # Documents come back from MongoDB as naive UTC.
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat() + "Z"
+
+
+def _fast_converter(field):
+    # Cheap equivalents of field.to_representation for the common cases;
+    # anything else falls back to the field itself.
+    if isinstance(field, serializers.DateTimeField):
+        output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+        if settings.USE_TZ and settings.TIME_ZONE == "UTC" and output_format == ISO_8601:
+            return _utc_isoformat
+        return field.to_representation
+    if isinstance(field, serializers.FloatField):
+        return float
+    if isinstance(field, serializers.CharField):
+        return str
+    return field.to_representation
+
+
+def compile_document_renderer(serializer_class, defaults=None):
+    """Build a function that renders raw MongoDB documents (as returned by
+    `as_pymongo()`) to the same dict `serializer_class` produces for the
+    hydrated MongoEngine document, without the per-field DRF machinery.
+
+    `defaults` supplies values for keys missing from older documents, matching
+    what MongoEngine would fill in on hydration.
+    """
+    defaults = defaults or {}
+    steps = tuple(
+        (name, "_id" if field.source == "id" else field.source, _fast_converter(field), defaults.get(field.source))
+        for name, field in serializer_class().fields.items()
+    )
+
+    def render(doc):
+        data = {}
+        for name, key, convert, default in steps:
+            value = doc.get(key, default)
+            data[name] = None if value is None else convert(value)
+        return data
+
+    return render
+
+
+def document_projection(serializer_class):
+    return [field.source for field in serializer_class().fields.values()]
+
+
+INVOICE_DOCUMENT_FIELDS = document_projection(InvoiceSerializer)
+render_invoice_document = compile_document_renderer(
+    InvoiceSerializer,
+    defaults={
+        name: field.default
+        for name, field in Invoice._fields.items()
+        if field.default is not None and not callable(field.default)
+    },
+)
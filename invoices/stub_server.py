@@ -0,0 +1,114 @@
+# invoices/stub_server.py
+
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """Answers /<prefix>/<key>/latest/<base>, /codes and /pair/<from>/<to>/<amount>
+    in the exchangerate-api.com v6 format."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        stub = self.server.stub
+        stub.count_request()
+        delay = stub.latency + random.uniform(0, stub.jitter)
+        if delay:
+            time.sleep(delay)
+        if stub.error_rate and random.random() < stub.error_rate:
+            stub.count_error()
+            return self.respond(stub.error_status, {"result": "error", "error-type": "injected-error"})
+        try:
+            status, body = self.route(stub.source, self.path.strip("/").split("/"))
+        except Exception as e:
+            status, body = 404, {"result": "error", "error-type": str(e)}
+        self.respond(status, body)
+
+    def route(self, source, parts):
+        # parts = [<prefix>..., <key>, <endpoint>, <args>...]
+        for i, part in enumerate(parts):
+            if part == "latest" and len(parts) == i + 2:
+                rates, updated_at = source.latest(parts[i + 1])
+                return 200, {
+                    "result": "success",
+                    "base_code": parts[i + 1],
+                    "time_last_update_unix": int(updated_at.timestamp()) if updated_at else None,
+                    "conversion_rates": rates,
+                }
+            if part == "codes" and len(parts) == i + 1:
+                codes = sorted(source.supported_codes().items())
+                return 200, {"result": "success", "supported_codes": [list(code) for code in codes]}
+            if part == "pair" and len(parts) == i + 4:
+                result, rate = source.pair(parts[i + 1], parts[i + 2], float(parts[i + 3]))
+                return 200, {"result": "success", "conversion_rate": rate, "conversion_result": result}
+        return 404, {"result": "error", "error-type": "unknown-endpoint"}
+
+    def respond(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubRateServer:
+    """Local stand-in for the rate provider, for load tests and isolated runs.
+
+    Serves rates from `source` (any RateProvider) after `latency` seconds plus
+    up to `jitter` more, and fails a `error_rate` fraction of requests with
+    `error_status`.
+    """
+
+    def __init__(self, source, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503):
+        self.source = source
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.errors = 0
+        self._counter_lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    def count_request(self):
+        with self._counter_lock:
+            self.requests += 1
+
+    def count_error(self):
+        with self._counter_lock:
+            self.errors += 1
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/v6"
+
+    def _bind(self):
+        self._httpd = ThreadingHTTPServer((self.host, self.port), StubRequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.stub = self
+        # Port 0 picks a free port; report the real one.
+        self.port = self._httpd.server_address[1]
+
+    def start(self):
+        if self._httpd is None:
+            self._bind()
+            self._thread = threading.Thread(target=self._httpd.serve_forever, name="rate-stub-server", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
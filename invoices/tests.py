@@ -1,9 +1,40 @@
+import asyncio
+import csv
 import json
+import math
+import random
+import os
+import tempfile
+from io import StringIO
+from datetime import datetime, timedelta, timezone
 from mongoengine import get_db
-from rest_framework.test import APITestCase
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory, APITestCase
+from rest_framework.views import APIView
 from rest_framework import status
-from unittest.mock import patch
-from invoices.models import Invoice
+from unittest.mock import AsyncMock, MagicMock, patch
+import numpy as np
+import requests
+from invoices.counters import compute_counters, counter_deltas, counter_drift, read_counter, stored_counters
+from invoices.models import Invoice, QuantileSketch, RateSnapshot, RevenueCounter, RevenueRollup
+from invoices.rollups import bucket_start
+from invoices.serializers import InvoiceSerializer, render_invoice_document
+from bson import ObjectId
+from invoices.currencies import CurrencyRegistry
+from invoices.filters import FilterError, build_invoice_match, parse_datetime_param
+from invoices.http import CircuitBreaker, CircuitOpen, ProviderClient, provider_client, provider_metrics
+from invoices.benchmarks import compare_reports, percentile
+from invoices.distribution import ColumnCache, InvoiceColumns, distribution, load_columns, scale_summary
+from invoices.metrics import PROVIDER_REQUEST_DURATION, REQUEST_DURATION, MetricsMiddleware, Registry
+from invoices.sketches import KLLSketch, apply_sketch_update, kll_rank_error, turnstile_quantiles
+from invoices.response_cache import bump_data_version, cache_analytics
+from invoices.providers import HTTPProvider, StaticFileProvider, load_provider
+from invoices.refresher import RateRefresher, refresher_metrics
+from invoices.stub_server import StubRateServer
+from invoices.rates import RateTable, RateTableCache, RateUnavailable, latest_snapshot, load_rate_table, prune_snapshots, save_snapshot
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.test import SimpleTestCase
 from django.urls import reverse
 
 class InvoiceListCreateAPIViewTests(APITestCase):
@@ -68,7 +99,9 @@ class InvoiceListCreateAPIViewTests(APITestCase):
         self.url = reverse("invoice-list-create")
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data, [])
+        self.assertEqual(response.data["results"], [])
+        self.assertIsNone(response.data["next"])
+        self.assertIsNone(response.data["previous"])
 
     @patch("invoices.views.get_supported_currencies")
     @patch("invoices.views.get_exchange_rate")
@@ -82,7 +115,73 @@ class InvoiceListCreateAPIViewTests(APITestCase):
         # Now fetch them
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data["results"]), 1)
+
+    def test_list_invoices_cursor_pagination(self):
+        created = [
+            Invoice.objects.create(amount=n, currency="USD", converted_amount=n, exchange_rate=1.0)
+            for n in range(1, 6)
+        ]
+        self.url = reverse("invoice-list-create")
+        first = self.client.get(self.url + "?limit=2")
+        self.assertEqual([row["amount"] for row in first.data["results"]], [1, 2])
+        self.assertIsNone(first.data["previous"])
+
+        second = self.client.get(self.url, {"limit": 2, "cursor": first.data["next"]})
+        self.assertEqual([row["id"] for row in second.data["results"]], [str(i.id) for i in created[2:4]])
+
+        back = self.client.get(self.url, {"limit": 2, "cursor": second.data["previous"]})
+        self.assertEqual([row["amount"] for row in back.data["results"]], [1, 2])
+        self.assertIsNone(back.data["previous"])
+
+        last = self.client.get(self.url, {"limit": 2, "cursor": second.data["next"]})
+        self.assertEqual([row["amount"] for row in last.data["results"]], [5])
+        self.assertIsNone(last.data["next"])
+
+    def test_list_invoices_filters(self):
+        for amount, currency, day in [(10, "EUR", 1), (500, "EUR", 2), (700, "GBP", 3), (900, "EUR", 20)]:
+            Invoice.objects.create(
+                amount=amount, currency=currency, converted_amount=amount, exchange_rate=1.0,
+                created_at=datetime(2025, 5, day),
+            )
+        self.url = reverse("invoice-list-create")
+        response = self.client.get(
+            self.url,
+            {"currency": "eur", "min_amount": 100, "created_after": "2025-05-01", "created_before": "2025-05-15"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row["amount"] for row in response.data["results"]], [500])
+
+        response = self.client.get(self.url, {"max_amount": "lots"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("max_amount", response.data)
+
+    def test_list_invoices_conditional(self):
+        self.url = reverse("invoice-list-create")
+        Invoice.objects.create(amount=10, currency="USD", exchange_rate=1.0, converted_amount=10)
+        response = self.client.get(self.url)
+        etag = response["ETag"]
+        self.assertNotIn("Last-Modified", response)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Invoice.objects.create(amount=20, currency="USD", exchange_rate=1.0, converted_amount=20)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+        # A delete leaves the newest updated_at alone but changes the page.
+        etag = response["ETag"]
+        Invoice.objects(amount=10).delete()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag, HTTP_IF_MODIFIED_SINCE="Fri, 01 Jan 2100 00:00:00 GMT")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 1)
+
+    def test_list_invoices_invalid_cursor(self):
+        self.url = reverse("invoice-list-create")
+        response = self.client.get(self.url + "?cursor=not-a-cursor")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("cursor", response.data)
 
     def tearDown(self):
         db = get_db()
@@ -90,6 +189,111 @@ class InvoiceListCreateAPIViewTests(APITestCase):
             db.drop_collection(collection_name)
 
 
+def plan_stages(plan):
+    """Every stage name in an explain() plan tree."""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(plan_stages(value))
+    return stages
+
+
+def plan_key_patterns(plan):
+    """The keyPattern of every index scan in an explain() plan tree."""
+    patterns = []
+    if isinstance(plan, dict):
+        if plan.get("stage") == "IXSCAN":
+            patterns.append(plan["keyPattern"])
+        for value in plan.values():
+            patterns.extend(plan_key_patterns(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            patterns.extend(plan_key_patterns(value))
+    return patterns
+
+
+class InvoiceFilterIndexTests(APITestCase):
+    def setUp(self):
+        Invoice.ensure_indexes()
+        for n in range(50):
+            Invoice.objects.create(
+                amount=n * 10, currency=["EUR", "GBP", "EGP"][n % 3], converted_amount=n * 10, exchange_rate=1.0
+            )
+
+    def tearDown(self):
+        Invoice.objects.delete()
+
+    def test_common_filters_use_an_index(self):
+        combinations = [
+            {"currency": "EUR"},
+            {"created_after": "2025-01-01"},
+            {"created_after": "2025-01-01", "created_before": "2030-01-01"},
+            {"currency": "EUR", "created_after": "2025-01-01"},
+            {"min_amount": "100", "max_amount": "200"},
+            {"currency": "GBP", "min_amount": "100"},
+        ]
+        for params in combinations:
+            with self.subTest(params=params):
+                match = build_invoice_match(params)
+                explain = (
+                    Invoice._get_collection()
+                    .find(match)
+                    .sort([("created_at", 1), ("_id", 1)])
+                    .limit(51)
+                    .explain()
+                )
+                winning = explain["queryPlanner"]["winningPlan"]
+                self.assertNotIn("COLLSCAN", plan_stages(winning))
+                # Every query sorts on (created_at, _id), so an index scan
+                # alone proves nothing: the winning index must lead with a
+                # filtered field and examine about as many documents as match.
+                leading = [next(iter(pattern)) for pattern in plan_key_patterns(winning)]
+                self.assertTrue(set(leading) & set(match), leading)
+                matching = Invoice._get_collection().count_documents(match)
+                examined = explain["executionStats"]["totalDocsExamined"]
+                self.assertLessEqual(examined, max(2 * matching, matching + 5))
+
+
+class AsyncInvoiceViewTests(APITestCase):
+    def tearDown(self):
+        Invoice.objects.delete()
+
+    @patch("invoices.async_views.aget_supported_currencies", new_callable=AsyncMock)
+    @patch("invoices.async_views.aget_exchange_rate", new_callable=AsyncMock)
+    async def test_async_create_invoice(self, mock_get_exchange_rate, mock_get_supported_currencies):
+        mock_get_supported_currencies.return_value = frozenset({"USD", "EGP"})
+        mock_get_exchange_rate.return_value = 0.02
+        response = await self.async_client.post(
+            reverse("async-invoice-create"), {"amount": 100, "currency": "EGP"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()["converted_amount"], 2.0)
+        self.assertEqual(await sync_to_async(Invoice.objects(currency="EGP").count)(), 1)
+
+    @patch("invoices.async_views.aget_supported_currencies", new_callable=AsyncMock)
+    async def test_async_create_invoice_unsupported_currency(self, mock_get_supported_currencies):
+        mock_get_supported_currencies.return_value = frozenset({"USD"})
+        response = await self.async_client.post(
+            reverse("async-invoice-create"), {"amount": 100, "currency": "XYZ"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch("invoices.async_views.aget_supported_currencies", new_callable=AsyncMock)
+    @patch("invoices.utils.rate_cache.aget_table", new_callable=AsyncMock)
+    async def test_async_total_revenue(self, mock_aget_table, mock_get_supported_currencies):
+        mock_get_supported_currencies.return_value = frozenset({"USD", "EUR"})
+        mock_aget_table.return_value = RateTable("USD", {"USD": 1.0, "EUR": 0.5})
+        await sync_to_async(Invoice.objects.create)(amount=100, currency="EUR", exchange_rate=1.1, converted_amount=110)
+        response = await self.async_client.get(reverse("async-total-revenue") + "?currency=EUR")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["total_revenue"], 55.0)
+
+
 class InvoiceDetailAPIViewTests(APITestCase):
     def setUp(self):
         self.invoice = Invoice(amount=100, currency="EUR", exchange_rate=1.1, converted_amount=110)
@@ -105,6 +309,24 @@ class InvoiceDetailAPIViewTests(APITestCase):
         self.assertEqual(response.data["amount"], 100)
         self.assertEqual(response.data["currency"], "EUR")
 
+    def test_get_invoice_conditional(self):
+        response = self.client.get(self.detail_url)
+        etag = response["ETag"]
+        self.assertEqual(etag, f'"{self.invoice.id}.1"')
+        self.assertIn("Last-Modified", response)
+
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.content, b"")
+
+        self.invoice.amount = 200
+        self.invoice.save()
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["ETag"], f'"{self.invoice.id}.2"')
+        self.assertEqual(response.data["amount"], 200)
+
     def test_get_invoice_not_found(self):
         fake_id = "666f6f6f6f6f6f6f6f6f6f6f"
         url = reverse("invoice-detail", kwargs={"pk": fake_id})
@@ -122,6 +344,26 @@ class InvoiceDetailAPIViewTests(APITestCase):
         self.assertEqual(updated.amount, 250)
         self.assertEqual(updated.currency, "USD")
 
+    @patch("invoices.views.get_exchange_rate", return_value=1.1)
+    @patch("invoices.views.get_supported_currencies", return_value=["USD", "EUR"])
+    def test_put_invoice_converts_through_rate_cache(self, mock_currencies, mock_rate):
+        data = {"amount": 100, "currency": "EUR"}
+        response = self.client.put(self.detail_url, data=json.dumps(data), content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        mock_rate.assert_called_once_with("EUR", "USD")
+        updated = Invoice.objects.get(id=self.invoice.id)
+        self.assertEqual(updated.exchange_rate, 1.1)
+        self.assertAlmostEqual(updated.converted_amount, 110)
+
+    @patch("invoices.views.get_exchange_rate", side_effect=RateUnavailable("provider down, no snapshot"))
+    @patch("invoices.views.get_supported_currencies", return_value=["USD", "EUR"])
+    def test_put_invoice_rate_unavailable(self, mock_currencies, mock_rate):
+        data = {"amount": 100, "currency": "EUR"}
+        response = self.client.put(self.detail_url, data=json.dumps(data), content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        unchanged = Invoice.objects.get(id=self.invoice.id)
+        self.assertEqual(unchanged.version, 1)
+
     def test_put_invoice_invalid_data(self):
         data = {"amount": "", "currency": ""}
         response = self.client.put(self.detail_url, data=json.dumps(data), content_type="application/json")
@@ -147,6 +389,292 @@ class InvoiceDetailAPIViewTests(APITestCase):
         self.assertEqual(response.data["detail"], "Not found")
 
 
+class RevenueCounterTests(APITestCase):
+    def tearDown(self):
+        Invoice.objects.delete()
+        RevenueCounter.objects.delete()
+
+    def test_counters_follow_create_update_delete(self):
+        invoice = Invoice.objects.create(amount=100, currency="EUR", exchange_rate=1.1, converted_amount=110)
+        Invoice.objects.create(amount=200, currency="GBP", exchange_rate=1.25, converted_amount=250)
+        self.assertEqual(read_counter()["count"], 2)
+        self.assertEqual(read_counter("EUR")["sum_amount"], 100)
+
+        invoice = Invoice.objects.get(id=invoice.id)
+        invoice.currency = "GBP"
+        invoice.amount = 80
+        invoice.converted_amount = 100
+        invoice.save()
+        self.assertEqual(read_counter("EUR")["count"], 0)
+        self.assertEqual(read_counter("GBP")["count"], 2)
+        self.assertAlmostEqual(read_counter()["sum_usd"], 350)
+
+        Invoice.objects(currency="GBP", amount=200).delete()
+        self.assertEqual(read_counter()["count"], 1)
+        self.assertAlmostEqual(read_counter("GBP")["sum_usd"], 100)
+        self.assertEqual(counter_drift(compute_counters(), stored_counters()), {})
+
+    @patch("invoices.models.InvoiceQuerySet.DELETE_BATCH_SIZE", 2)
+    def test_bulk_delete_reports_every_batch(self):
+        for amount in range(1, 6):
+            Invoice.objects.create(amount=amount, currency="EUR", exchange_rate=1.0, converted_amount=amount)
+        Invoice.objects.create(amount=50, currency="GBP", exchange_rate=1.0, converted_amount=50)
+        self.assertEqual(Invoice.objects(currency="EUR").delete(), 5)
+        self.assertEqual(read_counter("EUR")["count"], 0)
+        self.assertEqual(read_counter()["count"], 1)
+        self.assertEqual(counter_drift(compute_counters(), stored_counters()), {})
+
+    def test_reconcile_rebuilds_drifted_counters(self):
+        Invoice.objects.create(amount=100, currency="EUR", exchange_rate=1.1, converted_amount=110)
+        RevenueCounter.objects(key="EUR").update_one(inc__count=5)
+        out = StringIO()
+        call_command("reconcile_revenue_counters", stdout=out)
+        self.assertIn("EUR: count +5", out.getvalue())
+        self.assertEqual(read_counter("EUR")["count"], 1)
+
+    @patch("invoices.views.get_supported_currencies")
+    def test_invoices_predating_counters_fall_back_to_aggregation(self, mock_supported):
+        mock_supported.return_value = ["USD", "EUR"]
+        # Written straight to the collection, as on a database that existed
+        # before the counters did.
+        Invoice._get_collection().insert_one(
+            {"amount": 100, "currency": "EUR", "exchange_rate": 1.1, "converted_amount": 110, "created_at": datetime(2025, 1, 1)}
+        )
+        Invoice.objects.create(amount=10, currency="EUR", exchange_rate=1.1, converted_amount=11)
+        response = self.client.get(reverse("total-revenue") + "?currency=USD")
+        self.assertEqual(response.data["total_revenue"], 121)
+        response = self.client.get(reverse("average-invoice") + "?currency=USD&invoice_currency=EUR")
+        self.assertEqual(response.data["count"], 2)
+
+        call_command("reconcile_revenue_counters", stdout=StringIO())
+        self.assertEqual(read_counter()["count"], 2)
+
+    @patch("invoices.views.get_supported_currencies")
+    def test_failed_update_distrusts_counters_until_reconciled(self, mock_supported):
+        mock_supported.return_value = ["USD", "EUR"]
+        Invoice.objects.create(amount=100, currency="EUR", exchange_rate=1.1, converted_amount=110)
+        invoice = Invoice.objects.create(amount=10, currency="EUR", exchange_rate=1.1, converted_amount=11)
+        invoice.amount, invoice.converted_amount = 20, 22
+        with patch("pymongo.collection.Collection.bulk_write", side_effect=RuntimeError("write failed")):
+            invoice.save()
+        # The count still matches, but the sums missed the update.
+        self.assertEqual(read_counter()["count"], 2)
+        response = self.client.get(reverse("total-revenue") + "?currency=USD")
+        self.assertEqual(response.data["total_revenue"], 132)
+
+        call_command("reconcile_revenue_counters", stdout=StringIO())
+        self.assertFalse(RevenueCounter._get_collection().find_one({"_id": RevenueCounter.ALL_KEY})["dirty"])
+        self.assertAlmostEqual(read_counter()["sum_usd"], 132)
+
+
+class RevenueSeriesAPIViewTests(APITestCase):
+    def setUp(self):
+        self.url = reverse("revenue-series")
+        for day, amount, currency in [(3, 100, "EUR"), (3, 50, "GBP"), (4, 20, "EUR"), (12, 30, "EUR")]:
+            Invoice.objects.create(
+                amount=amount,
+                currency=currency,
+                exchange_rate=1.0,
+                converted_amount=amount,
+                created_at=datetime(2025, 3, day, 12),
+            )
+
+    def tearDown(self):
+        Invoice.objects.delete()
+        RevenueRollup.objects.delete()
+
+    @patch("invoices.views.get_supported_currencies")
+    def test_daily_series_in_range(self, mock_supported):
+        mock_supported.return_value = ["USD", "EUR", "GBP"]
+        response = self.client.get(self.url + "?interval=day&created_after=2025-03-01&created_before=2025-03-10")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(p["period_start"], p["count"], p["total_revenue"]) for p in response.data["series"]],
+            [(datetime(2025, 3, 3), 2, 150), (datetime(2025, 3, 4), 1, 20)],
+        )
+
+    @patch("invoices.views.get_supported_currencies")
+    def test_weekly_series_for_one_currency(self, mock_supported):
+        mock_supported.return_value = ["USD", "EUR", "GBP"]
+        response = self.client.get(self.url + "?interval=week&invoice_currency=EUR")
+        self.assertEqual(
+            [(p["period_start"], p["total_revenue"]) for p in response.data["series"]],
+            [(datetime(2025, 3, 3), 120), (datetime(2025, 3, 10), 30)],
+        )
+
+    @patch("invoices.views.get_supported_currencies")
+    def test_rollups_follow_deletes(self, mock_supported):
+        mock_supported.return_value = ["USD", "EUR", "GBP"]
+        Invoice.objects(amount=30).delete()
+        response = self.client.get(self.url + "?interval=month")
+        self.assertEqual([(p["count"], p["total_revenue"]) for p in response.data["series"]], [(3, 170)])
+
+    def test_invalid_interval(self):
+        response = self.client.get(self.url + "?interval=hour")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class InvoiceBulkCreateAPIViewTests(APITestCase):
+    def setUp(self):
+        self.url = reverse("invoice-bulk-create")
+
+    def tearDown(self):
+        Invoice.objects.delete()
+
+    @patch("invoices.views.get_supported_currencies")
+    @patch("invoices.views.get_exchange_rate")
+    def test_bulk_create_reports_per_item_results(self, mock_get_exchange_rate, mock_get_supported_currencies):
+        mock_get_supported_currencies.return_value = frozenset({"USD", "EGP"})
+        mock_get_exchange_rate.return_value = 0.02
+        data = [
+            {"amount": 100, "currency": "EGP"},
+            {"amount": 50, "currency": "XYZ"},
+            {"currency": "EGP"},
+            {"amount": 200, "currency": "EGP"},
+        ]
+        response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data["created"], 2)
+        self.assertEqual([r["status"] for r in response.data["results"]], ["created", "error", "error", "created"])
+        self.assertIn("currency", response.data["results"][1]["errors"])
+        self.assertIn("amount", response.data["results"][2]["errors"])
+        self.assertEqual(response.data["results"][3]["invoice"]["converted_amount"], 4.0)
+        mock_get_exchange_rate.assert_called_once_with("EGP", "USD")
+        self.assertEqual(Invoice.objects.count(), 2)
+        saved = Invoice.objects.get(id=response.data["results"][0]["invoice"]["id"])
+        self.assertEqual(InvoiceSerializer(saved).data, response.data["results"][0]["invoice"])
+
+    @patch("invoices.views.get_supported_currencies")
+    @patch("invoices.views.get_exchange_rate")
+    def test_bulk_create_all_valid(self, mock_get_exchange_rate, mock_get_supported_currencies):
+        mock_get_supported_currencies.return_value = frozenset({"USD", "EUR"})
+        mock_get_exchange_rate.return_value = 1.1
+        response = self.client.post(self.url, [{"amount": 10, "currency": "EUR"}] * 3, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Invoice.objects.count(), 3)
+
+    def test_bulk_create_requires_list(self):
+        response = self.client.post(self.url, {"amount": 10, "currency": "EUR"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ImportInvoicesCommandTests(APITestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "invoices.csv")
+        with open(self.path, "w") as f:
+            f.write("amount,currency,created_at\n")
+            f.write("100,EGP,2024-01-31T10:00:00Z\n")
+            f.write("abc,EGP,\n")
+            f.write("50,USD,\n")
+            f.write("75,XYZ,\n")
+            f.write("20,EGP,\n")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        Invoice.objects.delete()
+
+    @patch("invoices.management.commands.import_invoices.get_supported_currencies")
+    @patch("invoices.bulk.get_exchange_rate")
+    def test_import_csv_with_checkpoint(self, mock_get_exchange_rate, mock_get_supported_currencies):
+        mock_get_supported_currencies.return_value = frozenset({"USD", "EGP"})
+        mock_get_exchange_rate.side_effect = lambda currency, to="USD": 0.02 if currency == "EGP" else 1.0
+        checkpoint = os.path.join(self.tmpdir.name, "checkpoint")
+        call_command(
+            "import_invoices", self.path, "--batch-size", "2", "--checkpoint", checkpoint,
+            stdout=StringIO(), stderr=StringIO(),
+        )
+        self.assertEqual(Invoice.objects.count(), 3)
+        self.assertEqual(mock_get_exchange_rate.call_count, 2)
+        historical = Invoice.objects.get(amount=100)
+        self.assertEqual(historical.created_at, datetime(2024, 1, 31, 10))
+        self.assertEqual(historical.converted_amount, 2.0)
+        with open(checkpoint) as f:
+            self.assertEqual(f.read(), "5")
+
+        # Resuming from the end of the file writes nothing new.
+        call_command(
+            "import_invoices", self.path, "--checkpoint", checkpoint, "--resume",
+            stdout=StringIO(), stderr=StringIO(),
+        )
+        self.assertEqual(Invoice.objects.count(), 3)
+
+    @patch("invoices.management.commands.import_invoices.get_supported_currencies")
+    @patch("invoices.bulk.get_exchange_rate")
+    def test_import_ndjson_skips_malformed_rows(self, mock_get_exchange_rate, mock_get_supported_currencies):
+        mock_get_supported_currencies.return_value = frozenset({"USD"})
+        mock_get_exchange_rate.return_value = 1.0
+        path = os.path.join(self.tmpdir.name, "invoices.ndjson")
+        with open(path, "w") as f:
+            f.write('{"amount": 10, "currency": "USD"}\n')
+            f.write('{"amount": 20, "currency": \n')
+            f.write('{"amount": 30, "currency": "USD", "created_at": 1706695200}\n')
+            f.write('{"amount": 40, "currency": "USD"}\n')
+        checkpoint = os.path.join(self.tmpdir.name, "checkpoint")
+        out, err = StringIO(), StringIO()
+        call_command("import_invoices", path, "--checkpoint", checkpoint, stdout=out, stderr=err)
+        self.assertEqual(sorted(Invoice.objects.scalar("amount")), [10, 40])
+        self.assertIn("2 invalid", out.getvalue())
+        self.assertIn("row 1: ", err.getvalue())
+        self.assertIn("row 2: ", err.getvalue())
+        with open(checkpoint) as f:
+            self.assertEqual(f.read(), "4")
+
+    @patch("invoices.management.commands.import_invoices.get_supported_currencies")
+    @patch("invoices.bulk.get_exchange_rate")
+    def test_import_csv_rejects_bad_rates_and_rows(self, mock_get_exchange_rate, mock_get_supported_currencies):
+        mock_get_supported_currencies.return_value = frozenset({"USD", "EUR"})
+        mock_get_exchange_rate.return_value = 1.0
+        path = os.path.join(self.tmpdir.name, "rates.csv")
+        with open(path, "w") as f:
+            f.write("amount,currency,exchange_rate\n")
+            f.write("10,EUR,nan\n")
+            f.write("20,EUR,inf\n")
+            f.write("30,EUR,0\n")
+            f.write("40,EUR,-1.5\n")
+            f.write(f"50,EUR,{'1' * 200}\n")
+            f.write("60,EUR,1.1\n")
+        out, err = StringIO(), StringIO()
+        limit = csv.field_size_limit(100)
+        try:
+            call_command("import_invoices", path, stdout=out, stderr=err)
+        finally:
+            csv.field_size_limit(limit)
+        self.assertEqual(list(Invoice.objects.scalar("amount")), [60])
+        self.assertIn("row 4: ", err.getvalue())
+        self.assertIn("5 invalid", out.getvalue())
+        self.assertEqual(err.getvalue().count("A finite number greater than zero is required."), 4)
+
+
+class InvoiceExportAPIViewTests(APITestCase):
+    def setUp(self):
+        self.url = reverse("invoice-export")
+        self.invoice1 = Invoice.objects.create(amount=100, currency="EUR", exchange_rate=1.1, converted_amount=110)
+        self.invoice2 = Invoice.objects.create(amount=200, currency="GBP", exchange_rate=1.25, converted_amount=250)
+
+    def tearDown(self):
+        Invoice.objects.delete()
+
+    def test_export_ndjson(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(rows, InvoiceSerializer(Invoice.objects.order_by("created_at", "id"), many=True).data)
+
+    def test_export_csv_with_filter(self):
+        response = self.client.get(self.url + "?output=csv&currency=gbp")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "id,amount,currency,converted_amount,exchange_rate,created_at")
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith(f"{self.invoice2.id},200.0,GBP,250.0,1.25,"))
+
+    def test_export_unsupported_format(self):
+        response = self.client.get(self.url + "?output=xml")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
 class InvoiceExchangeRateAPIViewTests(APITestCase):
     def setUp(self):
         self.invoice = Invoice(
@@ -203,20 +731,21 @@ class TotalRevenueAPIViewTests(APITestCase):
         self.assertEqual(response.data["total_revenue"], round(110 + 250, 2))
 
     @patch("invoices.views.get_supported_currencies")
-    @patch("invoices.views.requests.get")
+    @patch("invoices.utils.rate_cache.get_table")
     def test_total_revenue_foreign_currency_success(
-        self, mock_requests_get, mock_supported
+        self, mock_get_table, mock_supported
     ):
         mock_supported.return_value = ["USD", "EUR", "GBP"]
-        mock_requests_get.return_value.status_code = 200
-        mock_requests_get.return_value.json.return_value = {
-            "conversion_result": 500.00
-        }
+        mock_get_table.return_value = RateTable(
+            "USD", {"USD": 1.0, "EUR": 0.9}, updated_at=datetime(2025, 5, 26, tzinfo=timezone.utc)
+        )
 
         response = self.client.get(self.url + "?currency=EUR")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data["currency"], "EUR")
-        self.assertEqual(response.data["total_revenue"], 500.00)
+        self.assertEqual(response.data["total_revenue"], 324.00)
+        self.assertEqual(response.data["exchange_rate"], 0.9)
+        self.assertEqual(response.data["rate_timestamp"], datetime(2025, 5, 26, tzinfo=timezone.utc))
 
     @patch("invoices.views.get_supported_currencies")
     def test_total_revenue_invalid_currency(self, mock_supported):
@@ -226,17 +755,227 @@ class TotalRevenueAPIViewTests(APITestCase):
         self.assertIn("Unsupported currency", response.data["currency"])
 
     @patch("invoices.views.get_supported_currencies")
-    @patch("invoices.views.requests.get")
+    @patch("invoices.utils.rate_cache.get_table")
     def test_total_revenue_exchange_api_failure(
-        self, mock_requests_get, mock_supported
+        self, mock_get_table, mock_supported
     ):
         mock_supported.return_value = ["USD", "EUR"]
-        mock_requests_get.side_effect = Exception("Conversion API failed")
+        mock_get_table.side_effect = Exception("Conversion API failed")
 
         response = self.client.get(self.url + "?currency=EUR")
         self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
         self.assertIn("Failed to convert USD to EUR", response.data["detail"])
 
+    @patch("invoices.views.get_supported_currencies")
+    def test_total_revenue_filtered_by_invoice_currency(self, mock_supported):
+        mock_supported.return_value = ["USD", "EUR", "GBP"]
+        response = self.client.get(self.url + "?currency=USD&invoice_currency=eur")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["total_revenue"], 110)
+
+    @patch("invoices.views.get_supported_currencies")
+    def test_total_revenue_filtered_by_date(self, mock_supported):
+        mock_supported.return_value = ["USD", "EUR", "GBP"]
+        response = self.client.get(self.url + "?created_before=2000-01-01")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["total_revenue"], 0.0)
+
+    @patch("invoices.views.get_supported_currencies")
+    def test_total_revenue_invalid_date_filter(self, mock_supported):
+        mock_supported.return_value = ["USD", "EUR", "GBP"]
+        response = self.client.get(self.url + "?created_after=yesterday")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("created_after", response.data)
+
+    @patch("invoices.views.get_supported_currencies")
+    def test_total_revenue_cached_until_invoice_write(self, mock_supported):
+        mock_supported.return_value = ["USD", "EUR", "GBP"]
+        self.client.get(self.url + "?currency=USD")
+        response = self.client.get(self.url + "?currency=USD")
+        self.assertEqual(response["X-Cache"], "HIT")
+
+        Invoice.objects.create(amount=10, currency="USD", exchange_rate=1.0, converted_amount=10)
+        response = self.client.get(self.url + "?currency=USD")
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["total_revenue"], 370)
+
+    @patch("invoices.views.get_supported_currencies")
+    def test_total_revenue_at_historical_rates(self, mock_supported):
+        mock_supported.return_value = ["USD", "EUR", "GBP", "JPY"]
+        for day, eur in ((1, 0.5), (10, 0.8)):
+            save_snapshot(
+                RateTable(
+                    "USD",
+                    {"USD": 1.0, "EUR": eur, "GBP": 0.5},
+                    fetched_at=datetime(2024, 3, day, 12, tzinfo=timezone.utc),
+                )
+            )
+        try:
+            response = self.client.get(self.url + "?currency=USD&rates_as_of=2024-03-05")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            # 100 EUR at 0.5 EUR/USD + 200 GBP at 0.5 GBP/USD
+            self.assertEqual(response.data["total_revenue"], 600.0)
+            self.assertEqual(response.data["rates_as_of"], "2024-03-05")
+
+            # The target currency is missing from the snapshot, not EUR/GBP.
+            response = self.client.get(self.url + "?currency=JPY&rates_as_of=2024-03-05")
+            self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+            self.assertIn("'JPY'", response.data["detail"])
+
+            response = self.client.get(self.url + "?currency=USD&rates_as_of=2024-02-01")
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        finally:
+            RateSnapshot.objects.delete()
+
+
+class RateSnapshotTests(APITestCase):
+    def tearDown(self):
+        RateSnapshot.objects.delete()
+
+    @patch("invoices.rates.fetch_rate_table")
+    def test_provider_outage_serves_latest_snapshot(self, mock_fetch):
+        mock_fetch.return_value = RateTable("USD", {"USD": 1.0, "EUR": 0.9})
+        load_rate_table("USD", ttl=0)
+        self.assertEqual(latest_snapshot("USD").rates["EUR"], 0.9)
+
+        mock_fetch.side_effect = requests.ConnectionError("down")
+        table = load_rate_table("USD", ttl=0)
+        self.assertEqual(table.rate("USD", "EUR"), 0.9)
+
+    @patch("invoices.rates.fetch_rate_table")
+    def test_fresh_snapshot_skips_provider(self, mock_fetch):
+        save_snapshot(RateTable("USD", {"USD": 1.0, "EUR": 0.9}))
+        self.assertEqual(load_rate_table("USD", ttl=300).rates["EUR"], 0.9)
+        mock_fetch.assert_not_called()
+
+    def test_old_snapshots_thinned_to_one_per_day(self):
+        now = datetime.now(timezone.utc)
+        for days, hour in ((30, 1), (30, 13), (30, 22), (29, 5), (1, 1), (1, 2)):
+            fetched_at = (now - timedelta(days=days)).replace(hour=hour, minute=0, second=0, microsecond=0)
+            RateSnapshot._get_collection().insert_one({"base": "USD", "fetched_at": fetched_at, "rates": {"USD": 1.0, "EUR": hour}})
+        self.assertEqual(prune_snapshots("USD", keep_days=7), 2)
+        self.assertEqual(RateSnapshot.objects(base="USD").count(), 4)
+        # The last table of the thinned day still answers rates_as_of.
+        as_of = (now - timedelta(days=29)).replace(hour=0, minute=0, second=0, microsecond=0)
+        self.assertEqual(latest_snapshot("USD", as_of).rates["EUR"], 22)
+
+
+class DistributionAPIViewTests(APITestCase):
+    def setUp(self):
+        self.url = reverse("distribution")
+        for amount, currency, converted in ((100, "EUR", 110), (200, "GBP", 250), (300, "EUR", 330)):
+            Invoice.objects.create(amount=amount, currency=currency, exchange_rate=converted / amount, converted_amount=converted)
+
+    def tearDown(self):
+        Invoice.objects.delete()
+
+    def test_load_columns_in_small_batches(self):
+        columns = load_columns(batch_size=2)
+        self.assertEqual(len(columns), 3)
+        self.assertEqual(sorted(columns.converted_amount.tolist()), [110, 250, 330])
+
+    @patch("invoices.views.get_supported_currencies")
+    def test_distribution_per_currency(self, mock_supported):
+        mock_supported.return_value = ["USD", "EUR", "GBP"]
+        response = self.client.get(self.url + "?currency=USD&bins=4")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["overall"]["median"], 250)
+        self.assertEqual(response.data["by_currency"]["EUR"]["count"], 2)
+        self.assertEqual(sum(response.data["overall"]["histogram"]["counts"]), 3)
+
+        response = self.client.get(self.url + "?field=amount&invoice_currency=EUR")
+        self.assertEqual(response.data["by_currency"]["EUR"]["median"], 200)
+
+    @patch("invoices.views.get_supported_currencies")
+    def test_distribution_invalid_params(self, mock_supported):
+        mock_supported.return_value = ["USD"]
+        self.assertEqual(self.client.get(self.url + "?percentiles=50,120").status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url + "?field=exchange_rate").status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ApproximatePercentilesAPIViewTests(APITestCase):
+    def setUp(self):
+        self.url = reverse("approximate-percentiles")
+        for converted in range(1, 101):
+            Invoice.objects.create(amount=converted, currency="EUR" if converted % 2 else "GBP", exchange_rate=1.0, converted_amount=converted)
+
+    def tearDown(self):
+        Invoice.objects.delete()
+        QuantileSketch.objects.delete()
+
+    @patch("invoices.views.get_supported_currencies")
+    def test_sketch_follows_writes(self, mock_supported):
+        mock_supported.return_value = ["USD", "EUR", "GBP"]
+        response = self.client.get(self.url + "?percentiles=50")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 100)
+        self.assertEqual(response.data["percentiles"]["p50"], 50)
+
+        Invoice.objects(converted_amount__lte=50).delete()
+        response = self.client.get(self.url + "?percentiles=50&invoice_currency=gbp")
+        self.assertEqual(response.data["count"], 25)
+        self.assertEqual(response.data["percentiles"]["p50"], 76)
+
+        call_command("rebuild_quantile_sketches", stdout=StringIO())
+        response = self.client.get(self.url + "?percentiles=50")
+        self.assertEqual(response.data["count"], 50)
+        self.assertAlmostEqual(response.data["rank_error"], kll_rank_error(200))
+
+    @patch("invoices.views.get_supported_currencies")
+    def test_dropped_update_marks_key_stale(self, mock_supported):
+        mock_supported.return_value = ["USD", "EUR", "GBP"]
+        self.assertLessEqual(QuantileSketch.objects(key="EUR").count(), 8)
+        # No attempts left: the update is given up, as under heavy contention.
+        self.assertFalse(apply_sketch_update("EUR", [1000.0], [], attempts=0))
+        response = self.client.get(self.url + "?percentiles=50&invoice_currency=EUR")
+        self.assertTrue(response.data["stale"])
+        self.assertEqual(response.data["count"], 50)
+
+        call_command("rebuild_quantile_sketches", stdout=StringIO())
+        response = self.client.get(self.url + "?percentiles=50&invoice_currency=EUR")
+        self.assertFalse(response.data["stale"])
+        self.assertEqual(QuantileSketch.objects(key="EUR").count(), 1)
+
+    def test_rejects_unsketched_filters(self):
+        response = self.client.get(self.url + "?created_after=2025-01-01")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RevenueByCurrencyAPIViewTests(APITestCase):
+    def setUp(self):
+        self.url = reverse("revenue-by-currency")
+        Invoice.objects.create(amount=100, currency="EUR", exchange_rate=1.1, converted_amount=110)
+        Invoice.objects.create(amount=300, currency="EUR", exchange_rate=1.1, converted_amount=330)
+        Invoice.objects.create(amount=200, currency="GBP", exchange_rate=1.25, converted_amount=250)
+
+    def tearDown(self):
+        Invoice.objects.delete()
+
+    @patch("invoices.views.get_supported_currencies")
+    @patch("invoices.utils.rate_cache.get_table")
+    def test_breakdown_in_target_currency(self, mock_get_table, mock_supported):
+        mock_supported.return_value = ["USD", "EUR", "GBP"]
+        mock_get_table.return_value = RateTable("USD", {"USD": 1.0, "EUR": 0.5, "GBP": 0.8})
+        response = self.client.get(self.url + "?currency=EUR")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["total_count"], 3)
+        self.assertEqual(response.data["total_revenue"], 345.0)
+        self.assertEqual(
+            response.data["by_currency"],
+            [
+                {"currency": "EUR", "count": 2, "sum_amount": 400, "sum_usd": 440, "revenue": 220.0},
+                {"currency": "GBP", "count": 1, "sum_amount": 200, "sum_usd": 250, "revenue": 125.0},
+            ],
+        )
+        mock_get_table.assert_called_once()
+
+    @patch("invoices.views.get_supported_currencies")
+    def test_breakdown_filtered(self, mock_supported):
+        mock_supported.return_value = ["USD", "EUR", "GBP"]
+        response = self.client.get(self.url + "?invoice_currency=gbp")
+        self.assertEqual([row["currency"] for row in response.data["by_currency"]], ["GBP"])
+        self.assertEqual(response.data["total_revenue"], 250)
+
 
 class AverageInvoiceAPIViewTests(APITestCase):
     def setUp(self):
@@ -266,22 +1005,27 @@ class AverageInvoiceAPIViewTests(APITestCase):
         self.assertEqual(response.data["currency"], "USD")
         expected_avg = round((110 + 250) / 2, 2)
         self.assertEqual(response.data["average_invoice"], expected_avg)
+        self.assertEqual(response.data["count"], 2)
+        self.assertEqual(response.data["total"], 360)
+        self.assertEqual(response.data["min"], 110)
+        self.assertEqual(response.data["max"], 250)
+        self.assertEqual(response.data["std_dev"], 70)
 
     @patch("invoices.views.get_supported_currencies")
-    @patch("invoices.views.requests.get")
+    @patch("invoices.utils.rate_cache.get_table")
     def test_average_invoice_foreign_currency_success(
-        self, mock_requests_get, mock_supported
+        self, mock_get_table, mock_supported
     ):
         mock_supported.return_value = ["USD", "EUR", "GBP"]
-        mock_requests_get.return_value.status_code = 200
-        mock_requests_get.return_value.json.return_value = {
-            "conversion_result": 180.00
-        }
+        mock_get_table.return_value = RateTable("USD", {"USD": 1.0, "EUR": 0.9})
 
         response = self.client.get(self.url + "?currency=EUR")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data["currency"], "EUR")
-        self.assertEqual(response.data["average_invoice"], 180.00)
+        self.assertEqual(response.data["average_invoice"], 162.00)
+        self.assertEqual(response.data["total"], 324.00)
+        self.assertEqual(response.data["max"], 225.00)
+        self.assertEqual(response.data["exchange_rate"], 0.9)
 
     @patch("invoices.views.get_supported_currencies")
     def test_average_invoice_unsupported_currency(self, mock_supported):
@@ -291,12 +1035,12 @@ class AverageInvoiceAPIViewTests(APITestCase):
         self.assertIn("Unsupported currency", response.data["currency"])
 
     @patch("invoices.views.get_supported_currencies")
-    @patch("invoices.views.requests.get")
+    @patch("invoices.utils.rate_cache.get_table")
     def test_average_invoice_conversion_api_failure(
-        self, mock_requests_get, mock_supported
+        self, mock_get_table, mock_supported
     ):
         mock_supported.return_value = ["USD", "EUR"]
-        mock_requests_get.side_effect = Exception("Conversion failed")
+        mock_get_table.side_effect = Exception("Conversion failed")
 
         response = self.client.get(self.url + "?currency=EUR")
         self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -312,4 +1056,551 @@ class AverageInvoiceAPIViewTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data["currency"], "USD")
         self.assertEqual(response.data["average_invoice"], 0.0)
-        self.assertEqual(response.data["count"], 0)
\ No newline at end of file
+        self.assertEqual(response.data["count"], 0)
+
+    @patch("invoices.views.get_supported_currencies")
+    @patch("invoices.utils.rate_cache.get_table", side_effect=RateUnavailable("provider down"))
+    def test_empty_results_need_no_rate_table(self, mock_get_table, mock_supported):
+        mock_supported.return_value = ["USD", "EUR", "GBP", "JPY"]
+        response = self.client.get(self.url + "?currency=EUR&invoice_currency=JPY")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 0)
+        response = self.client.get(reverse("total-revenue") + "?currency=EUR&invoice_currency=JPY")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["total_revenue"], 0.0)
+        mock_get_table.assert_not_called()
+
+
+class RateTableCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.fetches = []
+
+        def fetch(base):
+            self.fetches.append(base)
+            return RateTable(base, {"USD": 1.0, "EUR": 0.8, "EGP": 50.0})
+
+        self.cache = RateTableCache(fetch=fetch, ttl=60, max_entries=2, base_currency="USD")
+
+    def test_cross_rates_from_single_table(self):
+        self.assertAlmostEqual(self.cache.get_rate("EUR", "USD"), 1.25)
+        self.assertAlmostEqual(self.cache.get_rate("EGP", "EUR"), 0.016)
+        self.assertEqual(self.fetches, ["USD"])
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_unknown_currency(self):
+        with self.assertRaises(RateUnavailable):
+            self.cache.get_rate("XYZ", "USD")
+
+    @patch("invoices.rates.time.monotonic")
+    def test_expired_table_is_refetched(self, mock_monotonic):
+        mock_monotonic.return_value = 1000
+        self.cache.get_table()
+        mock_monotonic.return_value = 1061
+        self.cache.get_table()
+        self.assertEqual(self.fetches, ["USD", "USD"])
+        self.assertEqual(self.cache.stats()["expirations"], 1)
+
+    async def test_concurrent_async_misses_share_one_fetch(self):
+        async def afetch(base):
+            self.fetches.append(base)
+            await asyncio.sleep(0.01)
+            return RateTable(base, {"USD": 1.0, "EUR": 0.8})
+
+        self.cache.afetch = afetch
+        rates = await asyncio.gather(*(self.cache.aget_rate("EUR", "USD") for _ in range(5)))
+        self.assertEqual(rates, [1.25] * 5)
+        self.assertEqual(self.fetches, ["USD"])
+
+    def test_lru_eviction(self):
+        self.cache.get_table("USD")
+        self.cache.get_table("EUR")
+        self.cache.get_table("USD")
+        self.cache.get_table("EGP")
+        stats = self.cache.stats()
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["size"], 2)
+        self.cache.get_table("USD")
+        self.assertEqual(self.fetches, ["USD", "EUR", "EGP"])
+
+    def test_invoice_conversion_uses_rate_cache(self):
+        invoice = Invoice(amount=100, currency="EUR")
+        with patch("invoices.rates.rate_cache", self.cache):
+            self.assertEqual(invoice.convert_to_usd(), (125.0, 1.25))
+            invoice.currency = "XYZ"
+            with self.assertRaises(RateUnavailable):
+                invoice.convert_to_usd()
+
+
+class CurrencyRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.responses = [{"USD": "United States Dollar", "EUR": "Euro"}]
+
+        def fetch():
+            response = self.responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        self.registry = CurrencyRegistry(fetch=fetch, refresh_interval=60)
+
+    def test_codes_loaded_once(self):
+        self.assertEqual(self.registry.codes(), frozenset({"USD", "EUR"}))
+        self.assertIn("EUR", self.registry)
+        self.assertEqual(self.registry.name("EUR"), "Euro")
+        self.assertEqual(self.responses, [])
+
+    def test_initial_load_failure_raises(self):
+        self.responses = [Exception("API Error")]
+        with self.assertRaises(Exception):
+            self.registry.codes()
+
+    def test_failed_refresh_keeps_last_good_copy(self):
+        self.registry.codes()
+        self.responses = [Exception("API Error")]
+        with self.assertRaises(Exception):
+            self.registry.refresh()
+        self.assertEqual(self.registry.codes(), frozenset({"USD", "EUR"}))
+        self.assertIsNotNone(self.registry.last_error)
+
+    def test_initial_load_failure_uses_fallback(self):
+        self.responses = [Exception("API Error")]
+        self.registry.fallback = lambda: {"USD": "USD", "GBP": "GBP"}
+        self.assertEqual(self.registry.codes(), frozenset({"USD", "GBP"}))
+        self.assertIsNotNone(self.registry.last_error)
+
+
+class RateRefresherTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = RateTableCache(fetch=MagicMock(), ttl=300)
+        self.registry = MagicMock()
+        self.load = MagicMock(return_value=RateTable("USD", {"USD": 1.0, "EUR": 0.9}))
+        self.refresher = RateRefresher(cache=self.cache, registry=self.registry, load=self.load, interval=240)
+
+    def test_refresh_warms_cache(self):
+        self.assertTrue(self.refresher.refresh_once())
+        self.assertEqual(self.cache.get_rate("USD", "EUR"), 0.9)
+        self.cache.fetch.assert_not_called()
+        self.registry.refresh.assert_called_once()
+        self.assertIsNotNone(self.refresher.last_refresh)
+        self.assertIsNotNone(self.refresher.last_duration)
+
+    def test_failure_is_recorded(self):
+        self.load.side_effect = requests.ConnectionError("down")
+        self.refresher.refresh_once()
+        status = self.refresher.status()
+        self.assertEqual(status["failures"], 1)
+        self.assertIn("down", status["last_error"])
+        self.assertIsNone(status["last_refresh"])
+
+    def test_status_exported_as_metrics(self):
+        self.refresher.refresh_once()
+        registry = Registry()
+        registry.register_collector(refresher_metrics)
+        with patch("invoices.refresher.rate_refresher", self.refresher):
+            text = registry.render()
+        self.assertIn("invoices_rate_refresher_runs_total 1", text)
+        self.assertIn("invoices_rate_refresher_last_refresh_timestamp_seconds ", text)
+        self.assertIn("invoices_rate_refresher_last_duration_seconds ", text)
+        self.assertIn("invoices_rate_refresher_last_run_failed 0", text)
+
+    def test_overlapping_run_is_skipped(self):
+        self.refresher._run_lock.acquire()
+        try:
+            self.assertFalse(self.refresher.refresh_once())
+        finally:
+            self.refresher._run_lock.release()
+        self.load.assert_not_called()
+        self.assertEqual(self.refresher.skipped, 1)
+
+    def test_jittered_delay(self):
+        for _ in range(20):
+            self.assertTrue(216 <= self.refresher.next_delay() <= 264)
+
+
+class ProviderClientTests(SimpleTestCase):
+    def setUp(self):
+        self.client = ProviderClient(
+            "https://rates.example/v6",
+            "key",
+            max_retries=2,
+            backoff=0,
+            breaker=CircuitBreaker(failure_threshold=2, reset_timeout=30),
+        )
+        self.client.session = MagicMock()
+
+    def test_success_uses_timeouts(self):
+        self.client.session.get.return_value.status_code = 200
+        self.client.session.get.return_value.json.return_value = {"result": "success"}
+        self.assertEqual(self.client.get_json("latest", "USD"), {"result": "success"})
+        self.client.session.get.assert_called_once_with(
+            "https://rates.example/v6/key/latest/USD", timeout=self.client.timeout
+        )
+        self.assertEqual(self.client.stats()["calls"], 1)
+
+    def test_transient_errors_are_retried(self):
+        ok = MagicMock(status_code=200)
+        ok.json.return_value = {"result": "success"}
+        self.client.session.get.side_effect = [requests.ConnectionError("reset"), MagicMock(status_code=503), ok]
+        self.assertEqual(self.client.get_json("codes"), {"result": "success"})
+        self.assertEqual(self.client.session.get.call_count, 3)
+
+    def test_circuit_opens_after_repeated_failures(self):
+        self.client.session.get.side_effect = requests.Timeout("slow")
+        for _ in range(2):
+            with self.assertRaises(requests.Timeout):
+                self.client.get_json("codes")
+        with self.assertRaises(CircuitOpen):
+            self.client.get_json("codes")
+        self.assertEqual(self.client.session.get.call_count, 6)
+        self.assertEqual(self.client.breaker.state, "open")
+
+    def test_every_client_is_exported_by_base_url(self):
+        self.client.session.get.side_effect = requests.Timeout("slow")
+        for _ in range(2):
+            with self.assertRaises(requests.Timeout):
+                self.client.get_json("codes")
+        registry = Registry()
+        registry.register_collector(provider_metrics)
+        text = registry.render()
+        self.assertIn('invoices_provider_circuit_state{base_url="https://rates.example/v6",state="open"} 1', text)
+        self.assertIn(f'base_url="{provider_client.base_url}"', text)
+        self.assertIn(
+            'invoices_provider_request_duration_seconds_count{base_url="https://rates.example/v6",outcome="error"}',
+            "\n".join(PROVIDER_REQUEST_DURATION.render()),
+        )
+
+
+class RateProviderTests(SimpleTestCase):
+    def test_incomplete_backend_fails_at_load(self):
+        with self.assertRaises(TypeError):
+            load_provider({"BACKEND": "invoices.providers.RateProvider"})
+
+    def test_static_file_cross_rates(self):
+        provider = StaticFileProvider()
+        rates, updated_at = provider.latest("EUR")
+        self.assertEqual(rates["EUR"], 1.0)
+        self.assertAlmostEqual(rates["USD"] * provider.latest("USD")[0]["EUR"], 1.0)
+        self.assertIsNotNone(updated_at)
+        self.assertEqual(provider.supported_codes()["EUR"], "Euro")
+
+    def test_http_provider_against_stub_server(self):
+        server = StubRateServer(StaticFileProvider()).start()
+        self.addCleanup(server.stop)
+        provider = HTTPProvider(client=ProviderClient(server.base_url, "key", max_retries=0))
+        rates, _ = provider.latest("USD")
+        self.assertEqual(rates["EUR"], StaticFileProvider().latest("USD")[0]["EUR"])
+        self.assertIn("GBP", provider.supported_codes())
+        converted, rate = provider.pair("USD", "EUR", 10)
+        self.assertAlmostEqual(converted, 10 * rate)
+
+    def test_stub_server_injects_errors(self):
+        server = StubRateServer(StaticFileProvider(), error_rate=1.0, error_status=503).start()
+        self.addCleanup(server.stop)
+        provider = HTTPProvider(client=ProviderClient(server.base_url, "key", max_retries=0))
+        with self.assertRaises(Exception):
+            provider.latest("USD")
+        self.assertEqual(server.errors, 1)
+
+
+class BenchmarkReportTests(SimpleTestCase):
+    def test_percentile_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 95), 7)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_compare_reports_flags_regressions(self):
+        baseline = {"routes": {"list": {"p95_ms": 10.0, "throughput_rps": 100.0}, "detail": {"p95_ms": 5.0, "throughput_rps": 200.0}}}
+        current = {
+            "routes": {
+                "list": {"p95_ms": 15.0, "throughput_rps": 95.0},
+                "detail": {"p95_ms": 5.5, "throughput_rps": 190.0},
+                "new": {"p95_ms": 1.0, "throughput_rps": 1.0},
+            }
+        }
+        self.assertEqual(compare_reports(baseline, current, threshold=0.2), {"list": {"p95_ms": (10.0, 15.0)}})
+
+
+class MetricsTests(SimpleTestCase):
+    def test_histogram_renders_cumulative_buckets(self):
+        registry = Registry()
+        histogram = registry.histogram("latency_seconds", "Latency.", ("view",), buckets=(0.1, 1.0))
+        histogram.observe(0.05, view="a")
+        histogram.observe(0.5, view="a")
+        histogram.observe(5, view="a")
+        registry.counter("calls_total", "Calls.").inc(2)
+        registry.register_collector(lambda: [("hits_total", "counter", "Hits.", [({"cache": "rates"}, 3)])])
+        text = registry.render()
+        self.assertIn('latency_seconds_bucket{view="a",le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{view="a",le="1.0"} 2', text)
+        self.assertIn('latency_seconds_bucket{view="a",le="+Inf"} 3', text)
+        self.assertIn('latency_seconds_count{view="a"} 3', text)
+        self.assertIn("calls_total 2", text)
+        self.assertIn('hits_total{cache="rates"} 3', text)
+
+    def test_metrics_endpoint_records_requests_by_view(self):
+        self.client.get(reverse("revenue-series") + "?interval=hourly")
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        body = response.content.decode()
+        self.assertIn('invoices_http_request_duration_seconds_count{view="revenue-series",method="GET",status="400"}', body)
+        self.assertIn("invoices_rate_cache_hits_total", body)
+        self.assertIn("invoices_rate_refresher_running 0", body)
+        self.assertIn("invoices_rate_refresher_last_run_failed 0", body)
+
+
+    def test_middleware_records_raising_requests_as_500(self):
+        request = APIRequestFactory().get("/api/metrics-probe/")
+
+        def failing_view(request):
+            raise RuntimeError("boom")
+
+        with self.assertRaises(RuntimeError):
+            MetricsMiddleware(failing_view)(request)
+        text = "\n".join(REQUEST_DURATION.render())
+        self.assertIn('invoices_http_request_duration_seconds_count{view="<unresolved>",method="GET",status="500"}', text)
+
+
+class AnalyticsResponseCacheTests(SimpleTestCase):
+    def setUp(self):
+        calls = self.calls = []
+
+        class CountingView(APIView):
+            @cache_analytics("counting")
+            def get(self, request):
+                calls.append(request.query_params.get("currency"))
+                if request.query_params.get("currency") == "XYZ":
+                    return Response({"currency": "Unsupported"}, status=status.HTTP_400_BAD_REQUEST)
+                return Response({"calls": len(calls)})
+
+        self.view = CountingView.as_view()
+        self.factory = APIRequestFactory()
+
+    def get(self, query):
+        return self.view(self.factory.get("/counting/" + query))
+
+    def test_repeat_polls_hit_until_a_write(self):
+        first = self.get("?currency=EUR&min_amount=1")
+        self.assertEqual(first["X-Cache"], "MISS")
+        again = self.get("?min_amount=1&currency=EUR")
+        self.assertEqual(again["X-Cache"], "HIT")
+        self.assertEqual(again.data, first.data)
+        self.assertEqual(len(self.calls), 1)
+
+        self.get("?currency=GBP")
+        self.assertEqual(len(self.calls), 2)
+
+        bump_data_version()
+        self.assertEqual(self.get("?currency=EUR&min_amount=1")["X-Cache"], "MISS")
+        self.assertEqual(len(self.calls), 3)
+
+    def test_errors_are_not_cached(self):
+        self.get("?currency=XYZ")
+        self.assertEqual(self.get("?currency=XYZ").status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(self.calls), 2)
+
+
+def reference_percentile(values, pct):
+    # Linear interpolation between closest ranks, in plain Python.
+    ordered = sorted(values)
+    rank = pct / 100 * (len(ordered) - 1)
+    low = math.floor(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def reference_histogram(values, bins):
+    low, high = min(values), max(values)
+    width = (high - low) / bins
+    counts = [0] * bins
+    for value in values:
+        counts[min(int((value - low) / width), bins - 1)] += 1
+    return counts
+
+
+class DistributionTests(SimpleTestCase):
+    def setUp(self):
+        rng = random.Random(7)
+        currencies = ["EUR", "GBP", "USD"]
+        self.rows = [
+            (rng.choice(currencies), rng.lognormvariate(5, 1.2), datetime(2025, 1, 1 + i % 28))
+            for i in range(5000)
+        ]
+        self.columns = InvoiceColumns(
+            currencies,
+            np.array([currencies.index(row[0]) for row in self.rows], dtype=np.uint16),
+            np.array([row[1] * 2 for row in self.rows]),
+            np.array([row[1] for row in self.rows]),
+            np.array([row[2] for row in self.rows], dtype="datetime64[ms]"),
+        )
+
+    def assert_matches_reference(self, summary, values, bins):
+        self.assertEqual(summary["count"], len(values))
+        self.assertAlmostEqual(summary["mean"], sum(values) / len(values))
+        self.assertAlmostEqual(summary["median"], reference_percentile(values, 50))
+        for pct in (90, 99):
+            self.assertAlmostEqual(summary["percentiles"][f"p{pct}"], reference_percentile(values, pct))
+        self.assertEqual(summary["histogram"]["counts"], reference_histogram(values, bins))
+
+    def test_matches_pure_python_reference(self):
+        result = distribution(self.columns, {}, percentiles=(90, 99), bins=16)
+        self.assert_matches_reference(result["overall"], [row[1] for row in self.rows], 16)
+        for code, summary in result["by_currency"].items():
+            self.assert_matches_reference(summary, [row[1] for row in self.rows if row[0] == code], 16)
+
+    def test_filters_match_mongo_semantics(self):
+        match = {"currency": "EUR", "created_at": {"$gte": datetime(2025, 1, 10), "$lt": datetime(2025, 1, 20)}, "amount": {"$lte": 400}}
+        result = distribution(self.columns, match, field="amount", percentiles=(90, 99), bins=8)
+        expected = [
+            row[1] * 2
+            for row in self.rows
+            if row[0] == "EUR" and datetime(2025, 1, 10) <= row[2] < datetime(2025, 1, 20) and row[1] * 2 <= 400
+        ]
+        self.assertIsNone(result["overall"])
+        self.assertEqual(list(result["by_currency"]), ["EUR"])
+        self.assert_matches_reference(result["by_currency"]["EUR"], expected, 8)
+        self.assertEqual(distribution(self.columns, {"currency": "JPY"})["by_currency"], {})
+
+    def test_scale_summary(self):
+        summary = distribution(self.columns, {}, bins=4)["overall"]
+        scaled = scale_summary(summary, 0.5)
+        self.assertAlmostEqual(scaled["percentiles"]["p90"], summary["percentiles"]["p90"] * 0.5)
+        self.assertEqual(scaled["histogram"]["counts"], summary["histogram"]["counts"])
+
+    def test_columns_reused_until_version_changes(self):
+        version = [1]
+        cache = ColumnCache(loader=lambda: self.columns, version=lambda: version[0])
+        cache.get()
+        cache.get()
+        self.assertEqual(cache.loads, 1)
+        version[0] = 2
+        cache.get()
+        self.assertEqual(cache.loads, 2)
+
+    @patch("invoices.distribution.time.monotonic")
+    def test_columns_expire_after_max_age(self, mock_monotonic):
+        # Writes from other processes never bump this process's version.
+        cache = ColumnCache(loader=lambda: self.columns, version=lambda: 1, max_age=60)
+        mock_monotonic.return_value = 1000
+        cache.get()
+        mock_monotonic.return_value = 1059
+        cache.get()
+        self.assertEqual(cache.loads, 1)
+        mock_monotonic.return_value = 1060
+        cache.get()
+        self.assertEqual(cache.loads, 2)
+
+
+class KLLSketchTests(SimpleTestCase):
+    def setUp(self):
+        rng = random.Random(11)
+        self.values = [rng.lognormvariate(5, 1) for _ in range(20000)]
+        self.sketch = KLLSketch(k=200, rng=random.Random(3))
+        for value in self.values:
+            self.sketch.update(value)
+
+    def assert_rank_within(self, estimate, values, q, error):
+        ordered = sorted(values)
+        true_rank = sum(1 for value in ordered if value <= estimate)
+        self.assertLessEqual(abs(true_rank / len(ordered) - q), error)
+
+    def test_size_stays_bounded(self):
+        self.assertEqual(self.sketch.n, 20000)
+        self.assertLess(len(self.sketch), 3 * 200)
+
+    def test_quantiles_within_error_bound(self):
+        empty = KLLSketch(k=200)
+        for q, estimate in zip((0.5, 0.9, 0.99), turnstile_quantiles(self.sketch, empty, (0.5, 0.9, 0.99))):
+            self.assert_rank_within(estimate, self.values, q, kll_rank_error(200))
+
+    def test_turnstile_deletes(self):
+        deleted = KLLSketch(k=200, rng=random.Random(5))
+        removed = sorted(self.values)[:5000]
+        for value in removed:
+            deleted.update(value)
+        remaining = sorted(self.values)[5000:]
+        error = kll_rank_error(200) * (self.sketch.n + deleted.n) / len(remaining)
+        estimate = turnstile_quantiles(self.sketch, deleted, (0.5,))[0]
+        self.assert_rank_within(estimate, remaining, 0.5, error)
+
+    def test_merge_and_round_trip(self):
+        other = KLLSketch.from_dict(self.sketch.to_dict())
+        other.merge(KLLSketch.from_dict(self.sketch.to_dict()))
+        self.assertEqual(other.n, 40000)
+        estimate = turnstile_quantiles(other, KLLSketch(k=200), (0.5,))[0]
+        self.assert_rank_within(estimate, self.values, 0.5, kll_rank_error(200))
+
+
+class InvoiceFilterTests(SimpleTestCase):
+    def test_build_invoice_match(self):
+        match = build_invoice_match(
+            {"invoice_currency": "egp", "created_after": "2025-05-01", "created_before": "2025-06-01T02:00:00+02:00"},
+            currency_param="invoice_currency",
+        )
+        self.assertEqual(
+            match,
+            {
+                "currency": "EGP",
+                "created_at": {"$gte": datetime(2025, 5, 1), "$lt": datetime(2025, 6, 1)},
+            },
+        )
+
+    def test_invalid_date(self):
+        with self.assertRaises(FilterError):
+            build_invoice_match({"created_before": "2025-13-01"})
+        with self.assertRaises(FilterError):
+            parse_datetime_param({"created_at": 1706695200}, "created_at")
+
+    def test_amount_range(self):
+        self.assertEqual(
+            build_invoice_match({"min_amount": "10", "max_amount": "99.5"}),
+            {"amount": {"$gte": 10.0, "$lte": 99.5}},
+        )
+        with self.assertRaises(FilterError):
+            build_invoice_match({"min_amount": "ten"})
+
+
+class RenderInvoiceDocumentTests(SimpleTestCase):
+    def test_matches_invoice_serializer(self):
+        documents = [
+            {
+                "_id": ObjectId(),
+                "amount": 100,
+                "currency": "EGP",
+                "converted_amount": 2.04,
+                "exchange_rate": 0.0204,
+                "created_at": datetime(2025, 5, 26, 13, 21, 0, 123000),
+            },
+            {"_id": ObjectId(), "amount": 12.5, "currency": "EUR", "created_at": datetime(2025, 5, 26)},
+        ]
+        for doc in documents:
+            self.assertEqual(render_invoice_document(doc), InvoiceSerializer(Invoice._from_son(doc)).data)
+
+
+class CounterDeltaTests(SimpleTestCase):
+    def test_deltas_net_out_per_key(self):
+        before = {"currency": "EUR", "amount": 100, "converted_amount": 110}
+        after = {"currency": "EUR", "amount": 150, "converted_amount": 165}
+        deltas = counter_deltas(created=[after], deleted=[before])
+        self.assertEqual(deltas["EUR"]["count"], 0)
+        self.assertEqual(deltas["EUR"]["sum_amount"], 50)
+        self.assertEqual(deltas[RevenueCounter.ALL_KEY]["sum_usd"], 55)
+        self.assertEqual(deltas["EUR"]["sum_sq_usd"], 165 ** 2 - 110 ** 2)
+
+    def test_drift_ignores_float_noise(self):
+        expected = {"*": {"count": 1, "sum_usd": 0.3, "sum_sq_usd": 0.09, "sum_amount": 0.3}}
+        stored = {
+            "*": {"count": 1, "sum_usd": 0.1 + 0.2, "sum_sq_usd": 0.09, "sum_amount": 0.3},
+            "EUR": {"count": 2, "sum_usd": 0, "sum_sq_usd": 0, "sum_amount": 0},
+        }
+        self.assertEqual(counter_drift(expected, stored), {"EUR": {"count": 2}})
+
+
+class BucketStartTests(SimpleTestCase):
+    def test_bucket_boundaries(self):
+        value = datetime(2025, 5, 29, 18, 30)  # a Thursday
+        self.assertEqual(bucket_start(value, "day"), datetime(2025, 5, 29))
+        self.assertEqual(bucket_start(value, "week"), datetime(2025, 5, 26))
+        self.assertEqual(bucket_start(value, "month"), datetime(2025, 5, 1))
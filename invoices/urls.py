@@ -1,16 +1,26 @@
 # invoices/urls.py
 
 from django.urls import path
+from django.views.decorators.csrf import csrf_exempt
+from .async_views import AsyncAverageInvoiceView, AsyncInvoiceCreateView, AsyncTotalRevenueView
 from .views import (
     InvoiceListCreateAPIView,
+    InvoiceBulkCreateAPIView,
     InvoiceDetailAPIView,
+    InvoiceExportAPIView,
     InvoiceExchangeRateAPIView,
     TotalRevenueAPIView,
     AverageInvoiceAPIView,
+    RevenueSeriesAPIView,
+    DistributionAPIView,
+    ApproximatePercentilesAPIView,
+    RevenueByCurrencyAPIView,
 )
 
 urlpatterns = [
     path("invoices/", InvoiceListCreateAPIView.as_view(), name="invoice-list-create"),
+    path("invoices/bulk/", InvoiceBulkCreateAPIView.as_view(), name="invoice-bulk-create"),
+    path("invoices/export/", InvoiceExportAPIView.as_view(), name="invoice-export"),
     path("invoices/<str:pk>", InvoiceDetailAPIView.as_view(), name="invoice-detail"),
     path(
         "invoices/<str:pk>/exchange-rate",
@@ -25,4 +35,40 @@ urlpatterns = [
         AverageInvoiceAPIView.as_view(),
         name="average-invoice",
     ),
+    path(
+        "analytics/revenue-series/",
+        RevenueSeriesAPIView.as_view(),
+        name="revenue-series",
+    ),
+    path(
+        "analytics/distribution/",
+        DistributionAPIView.as_view(),
+        name="distribution",
+    ),
+    path(
+        "analytics/percentiles/",
+        ApproximatePercentilesAPIView.as_view(),
+        name="approximate-percentiles",
+    ),
+    path(
+        "analytics/revenue-by-currency/",
+        RevenueByCurrencyAPIView.as_view(),
+        name="revenue-by-currency",
+    ),
+    # Async variants for ASGI deployments (invoices_api/asgi.py)
+    path(
+        "async/invoices/",
+        csrf_exempt(AsyncInvoiceCreateView.as_view()),
+        name="async-invoice-create",
+    ),
+    path(
+        "async/analytics/total-revenue/",
+        AsyncTotalRevenueView.as_view(),
+        name="async-total-revenue",
+    ),
+    path(
+        "async/analytics/average-invoice/",
+        AsyncAverageInvoiceView.as_view(),
+        name="async-average-invoice",
+    ),
 ]
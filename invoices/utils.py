@@ -1,25 +1,33 @@
-import requests
-from rest_framework import status
-from rest_framework.response import Response
+from .currencies import currency_registry
+from .rates import rate_cache
 
-from invoices_api import settings
-
-api_key = settings.EXCHANGE_API_KEY
-base_url = settings.EXCHANGE_API_URL
 
 def get_supported_currencies():
-    url = f"{base_url}/{api_key}/codes"
-    response = requests.get(url)
-    response.raise_for_status()
-    data = response.json()
-    # data['supported_codes'] is a list like [['USD', 'United States Dollar'], ...]
-    return [code[0] for code in data["supported_codes"]]
+    return currency_registry.codes()
+
+
+async def aget_supported_currencies():
+    return await currency_registry.acodes()
 
 
 def get_exchange_rate(from_currency, to_currency="USD"):
-    url = f"{base_url}/{api_key}/latest/{from_currency}"
-    response = requests.get(url)
-    response.raise_for_status()
-    data = response.json()
-    rates = data["conversion_rates"]
-    return rates.get(to_currency)
\ No newline at end of file
+    return rate_cache.get_rate(from_currency, to_currency)
+
+
+async def aget_exchange_rate(from_currency, to_currency="USD"):
+    return await rate_cache.aget_rate(from_currency, to_currency)
+
+
+def get_usd_conversion(to_currency):
+    """Rate and as-of timestamp for converting USD amounts locally."""
+    if to_currency == "USD":
+        return 1.0, None
+    table = rate_cache.get_table()
+    return table.rate("USD", to_currency), table.updated_at
+
+
+async def aget_usd_conversion(to_currency):
+    if to_currency == "USD":
+        return 1.0, None
+    table = await rate_cache.aget_table()
+    return table.rate("USD", to_currency), table.updated_at
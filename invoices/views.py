@@ -1,26 +1,79 @@
 # invoices/views.py
+from django.http import HttpResponse, StreamingHttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 
-import requests
 from invoices_api import settings
-from .models import Invoice
-from .serializers import InvoiceSerializer
+from .analytics import revenue_at_rates, revenue_by_currency, summarize_invoices, total_revenue_usd
+from .bulk import RateResolver, insert_invoice_documents, prepare_invoice
+from .distribution import DISTRIBUTION_FIELDS, DistributionTooLarge, column_cache, distribution, scale_summary
+from .conditional import VALIDATOR_FIELDS, document_etag, last_modified, not_modified, page_etag, set_validators
+from .export import EXPORT_FORMATS, iter_invoice_documents
+from .filters import FilterError, build_invoice_match, parse_datetime_param
+from .metrics import registry
+from .models import Invoice, RevenueCounter, RevenueRollup
+from .pagination import PaginationError, keyset_page, parse_limit
+from .rates import latest_snapshot, rate_cache
+from .response_cache import cache_analytics
+from .rollups import revenue_series
+from .sketches import approximate_quantiles
+from .serializers import INVOICE_DOCUMENT_FIELDS, InvoiceSerializer, render_invoice_document
+from bson import ObjectId
 from mongoengine.errors import DoesNotExist
-from .utils import get_exchange_rate,get_supported_currencies
+from .utils import get_exchange_rate, get_supported_currencies, get_usd_conversion
 
-api_key = settings.EXCHANGE_API_KEY
-base_url = settings.EXCHANGE_API_URL
+VALIDATOR_PROJECTION = dict.fromkeys(VALIDATOR_FIELDS, 1)
+DETAIL_PROJECTION = {name: 1 for name in (*INVOICE_DOCUMENT_FIELDS, *VALIDATOR_FIELDS) if name != "id"}
 
 def get_object(pk):
     return Invoice.objects.get(id=pk)
 
+def invoice_statistics(currency, stats, rate=1.0, rate_timestamp=None):
+    return {
+        "currency": currency,
+        "average_invoice": round(stats["mean"] * rate, 2),
+        "count": stats["count"],
+        "total": round(stats["total"] * rate, 2),
+        "min": round(stats["min"] * rate, 2),
+        "max": round(stats["max"] * rate, 2),
+        "std_dev": round(stats["std_dev"] * rate, 2),
+        "exchange_rate": rate,
+        "rate_timestamp": rate_timestamp,
+    }
+
+def conversion_failed(target_currency, error):
+    return Response(
+        {"detail": f"Failed to convert USD to {target_currency}: {str(error)}"},
+        status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+    )
+
 class InvoiceListCreateAPIView(APIView):
     def get(self, request):
-        invoices = Invoice.objects()
-        serializer = InvoiceSerializer(invoices, many=True)
-        return Response(serializer.data)
+        try:
+            match = build_invoice_match(request.query_params)
+            limit = parse_limit(request.query_params)
+            invoices, next_cursor, previous_cursor = keyset_page(
+                match, request.query_params.get("cursor"), limit
+            )
+        except (FilterError, PaginationError) as e:
+            return Response({e.param: e.message}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Validate against the page's ids and versions before rendering it.
+        # No Last-Modified: deleting an invoice from the page changes the
+        # page without moving its newest updated_at forward.
+        etag = page_etag(invoices, next_cursor, previous_cursor)
+        cached = not_modified(request, etag, None)
+        if cached is not None:
+            return cached
+        response = Response(
+            {
+                "results": [render_invoice_document(doc) for doc in invoices],
+                "next": next_cursor,
+                "previous": previous_cursor,
+            }
+        )
+        return set_validators(response, etag, None)
 
     def post(self, request):
         serializer = InvoiceSerializer(data=request.data)
@@ -41,7 +94,7 @@ class InvoiceListCreateAPIView(APIView):
         if currency not in supported_currencies:
             return Response(
                 {
-                    "currency": f"Unsupported currency '{currency}'. Supported currencies: {supported_currencies}"
+                    "currency": f"Unsupported currency '{currency}'."
                 },
                 status=status.HTTP_400_BAD_REQUEST,
             )
@@ -65,15 +118,95 @@ class InvoiceListCreateAPIView(APIView):
         invoice.save()
         return Response(InvoiceSerializer(invoice).data, status=status.HTTP_201_CREATED)
 
+class InvoiceBulkCreateAPIView(APIView):
+    def post(self, request):
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return Response(
+                {"detail": "Expected a non-empty list of invoices."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(items) > settings.INVOICE_BULK_MAX_ITEMS:
+            return Response(
+                {"detail": f"At most {settings.INVOICE_BULK_MAX_ITEMS} invoices can be created per request."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            supported_currencies = get_supported_currencies()
+        except Exception as e:
+            return Response(
+                {
+                    "detail": f"Unable to retrieve supported currencies at this time.Due To: {str(e)}"
+                },
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+
+        resolve_rate = RateResolver(get_exchange_rate)
+        results = []
+        documents = []
+        for index, item in enumerate(items):
+            document, errors = prepare_invoice(item, supported_currencies, resolve_rate)
+            if errors:
+                results.append({"index": index, "status": "error", "errors": errors})
+            else:
+                documents.append(document)
+                results.append({"index": index, "status": "created", "document": document})
+
+        failed = insert_invoice_documents(documents)
+        created = 0
+        for result in results:
+            document = result.pop("document", None)
+            if document is None:
+                continue
+            if document["_id"] in failed:
+                result.update(status="error", errors={"detail": failed[document["_id"]]})
+            else:
+                result["invoice"] = render_invoice_document(document)
+                created += 1
+
+        return Response(
+            {"created": created, "failed": len(results) - created, "results": results},
+            status=status.HTTP_201_CREATED if created == len(results) else status.HTTP_207_MULTI_STATUS,
+        )
+
+class InvoiceExportAPIView(APIView):
+    def get(self, request):
+        output = request.query_params.get("output", "ndjson").lower()
+        if output not in EXPORT_FORMATS:
+            return Response(
+                {"output": f"Unsupported export format '{output}'. Use one of: {', '.join(EXPORT_FORMATS)}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            match = build_invoice_match(request.query_params)
+        except FilterError as e:
+            return Response({e.param: e.message}, status=status.HTTP_400_BAD_REQUEST)
+
+        stream, content_type = EXPORT_FORMATS[output]
+        response = StreamingHttpResponse(stream(iter_invoice_documents(match)), content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="invoices.{output}"'
+        return response
+
 class InvoiceDetailAPIView(APIView):
     def get(self, request, pk):
-        try:
-            invoice = get_object(pk)
-        except DoesNotExist as e:
+        if not ObjectId.is_valid(pk):
             return Response({"detail": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+        collection = Invoice._get_collection()
+        if "HTTP_IF_NONE_MATCH" in request.META or "HTTP_IF_MODIFIED_SINCE" in request.META:
+            # Revalidation: read the validators alone and skip the document
+            # when the client's copy is current.
+            doc = collection.find_one({"_id": ObjectId(pk)}, VALIDATOR_PROJECTION)
+            if doc is None:
+                return Response({"detail": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+            cached = not_modified(request, document_etag(doc), last_modified(doc))
+            if cached is not None:
+                return cached
 
-        json_data = InvoiceSerializer(invoice)
-        return Response(json_data.data,status=status.HTTP_200_OK)
+        doc = collection.find_one({"_id": ObjectId(pk)}, DETAIL_PROJECTION)
+        if doc is None:
+            return Response({"detail": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+        response = Response(render_invoice_document(doc), status=status.HTTP_200_OK)
+        return set_validators(response, document_etag(doc), last_modified(doc))
 
     def put(self, request, pk):
         try:
@@ -97,11 +230,21 @@ class InvoiceDetailAPIView(APIView):
             if invoice.currency not in supported_currencies:
                 return Response(
                     {
-                        "currency": f"Unsupported currency '{invoice.currency}'. Supported currencies: {supported_currencies}"
+                        "currency": f"Unsupported currency '{invoice.currency}'."
                     },
                     status=status.HTTP_400_BAD_REQUEST,
                 )
-            invoice.converted_amount = 0  # reset to force recalculation
+            try:
+                exchange_rate = get_exchange_rate(invoice.currency, "USD")
+            except Exception as e:
+                return Response(
+                    {
+                        "detail": f"Exchange rate for currency '{invoice.currency}' is not available."
+                    },
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                )
+            invoice.exchange_rate = exchange_rate
+            invoice.converted_amount = invoice.amount * exchange_rate
             invoice.save()
             return Response(InvoiceSerializer(invoice).data,status=status.HTTP_204_NO_CONTENT)
         return Response(json_data.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -129,6 +272,7 @@ class InvoiceExchangeRateAPIView(APIView):
 
 
 class TotalRevenueAPIView(APIView):
+    @cache_analytics("total-revenue")
     def get(self, request):
         target_currency = request.query_params.get("currency", "USD").upper()
         try:
@@ -143,44 +287,64 @@ class TotalRevenueAPIView(APIView):
         if target_currency not in supported_currencies:
             return Response(
                 {
-                    "currency": f"Unsupported currency '{target_currency}'. Supported currencies: {supported_currencies}"
+                    "currency": f"Unsupported currency '{target_currency}'."
                 },
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        invoices = Invoice.objects()
-        if not invoices:
-            return Response(
-                {"currency": target_currency, "total_revenue": 0.0}
-            )
-        # Sum of all converted_amounts (they're in USD)
-        total_usd = sum(invoice.converted_amount for invoice in Invoice.objects)
-
-        # No need to convert
-        if target_currency == "USD":
-            return Response({"currency": "USD", "total_revenue": round(total_usd, 2)})
-
-        # Convert total USD revenue to requested currency
         try:
-            url = f"{base_url}/{api_key}/pair/USD/{target_currency}/{total_usd}"
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
+            match = build_invoice_match(request.query_params, currency_param="invoice_currency")
+            rates_as_of = parse_datetime_param(request.query_params, "rates_as_of", end_of_day=True)
+        except FilterError as e:
+            return Response({e.param: e.message}, status=status.HTTP_400_BAD_REQUEST)
 
-            converted_total = data["conversion_result"]
+        if rates_as_of:
+            # Revenue at the stored rates of a past date; no provider call
+            table = latest_snapshot(rate_cache.base_currency, rates_as_of)
+            if table is None:
+                return Response(
+                    {"rates_as_of": "No stored exchange rates on or before that date."},
+                    status=status.HTTP_404_NOT_FOUND,
+                )
+            try:
+                total, rate = revenue_at_rates(match, table, target_currency)
+            except Exception as e:
+                return conversion_failed(target_currency, e)
             return Response(
                 {
                     "currency": target_currency,
-                    "total_revenue": round(converted_total, 2),
+                    "total_revenue": round(total, 2),
+                    "exchange_rate": rate,
+                    "rate_timestamp": table.updated_at,
+                    # As sent; the parsed value is the end of that day.
+                    "rates_as_of": request.query_params["rates_as_of"],
                 }
             )
-        except Exception as e:
+
+        # Sum of all converted_amounts (they're in USD)
+        total_usd = total_revenue_usd(match)
+        if not total_usd:
+            # Zero in any currency; no rate table needed
             return Response(
-                {"detail": f"Failed to convert USD to {target_currency}: {str(e)}"},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                {"currency": target_currency, "total_revenue": 0.0, "exchange_rate": None, "rate_timestamp": None}
             )
 
+        # Convert total USD revenue locally against the cached rate table
+        try:
+            rate, rate_timestamp = get_usd_conversion(target_currency)
+        except Exception as e:
+            return conversion_failed(target_currency, e)
+        return Response(
+            {
+                "currency": target_currency,
+                "total_revenue": round(total_usd * rate, 2),
+                "exchange_rate": rate,
+                "rate_timestamp": rate_timestamp,
+            }
+        )
+
 
 class AverageInvoiceAPIView(APIView):
+    @cache_analytics("average-invoice")
     def get(self, request):
         target_currency = request.query_params.get("currency", "USD").upper()
         try:
@@ -195,46 +359,283 @@ class AverageInvoiceAPIView(APIView):
         if target_currency not in supported_currencies:
             return Response(
                 {
-                    "currency": f"Unsupported currency '{target_currency}'. Supported currencies: {supported_currencies}"
+                    "currency": f"Unsupported currency '{target_currency}'."
                 },
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        invoices = Invoice.objects()
+        try:
+            match = build_invoice_match(request.query_params, currency_param="invoice_currency")
+        except FilterError as e:
+            return Response({e.param: e.message}, status=status.HTTP_400_BAD_REQUEST)
+
+        # count/sum/mean/min/max/std_dev of converted_amount in one pass
+        stats = summarize_invoices(match)
+        if not stats["count"]:
+            # Nothing to convert; no rate table needed
+            return Response(dict(invoice_statistics(target_currency, stats), exchange_rate=None))
+
+        # Convert statistics locally against the cached rate table
+        try:
+            rate, rate_timestamp = get_usd_conversion(target_currency)
+        except Exception as e:
+            return conversion_failed(target_currency, e)
+        return Response(invoice_statistics(target_currency, stats, rate, rate_timestamp))
+
 
-        if not invoices:
+class RevenueSeriesAPIView(APIView):
+    def get(self, request):
+        target_currency = request.query_params.get("currency", "USD").upper()
+        interval = request.query_params.get("interval", "day").lower()
+        if interval not in RevenueRollup.GRANULARITIES:
+            return Response(
+                {"interval": f"Unsupported interval '{interval}'. Use one of: {', '.join(RevenueRollup.GRANULARITIES)}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            supported_currencies = get_supported_currencies()
+        except Exception as e:
+            return Response(
+                {
+                    "detail": f"Unable to retrieve supported currencies at this time.Due To: {str(e)}"
+                },
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+        if target_currency not in supported_currencies:
             return Response(
-                {"currency": target_currency, "average_invoice": 0.0, "count": 0}
+                {
+                    "currency": f"Unsupported currency '{target_currency}'."
+                },
+                status=status.HTTP_400_BAD_REQUEST,
             )
+        try:
+            start = parse_datetime_param(request.query_params, "created_after")
+            end = parse_datetime_param(request.query_params, "created_before")
+        except FilterError as e:
+            return Response({e.param: e.message}, status=status.HTTP_400_BAD_REQUEST)
+        invoice_currency = request.query_params.get("invoice_currency")
 
-        total_usd = sum(inv.converted_amount for inv in invoices)
-        count = invoices.count()
-        avg_usd = total_usd / count
+        # Read only the pre-aggregated buckets inside the range
+        series = revenue_series(interval, start, end, invoice_currency.upper() if invoice_currency else None)
 
-        # No conversion needed
-        if target_currency == "USD":
+        try:
+            rate, rate_timestamp = get_usd_conversion(target_currency)
+        except Exception as e:
+            return conversion_failed(target_currency, e)
+        return Response(
+            {
+                "currency": target_currency,
+                "interval": interval,
+                "exchange_rate": rate,
+                "rate_timestamp": rate_timestamp,
+                "series": [
+                    {
+                        "period_start": point["bucket"],
+                        "count": point["count"],
+                        "total_revenue": round(point["sum_usd"] * rate, 2),
+                    }
+                    for point in series
+                ],
+            }
+        )
+
+
+
+def parse_percentiles(params):
+    value = params.get("percentiles")
+    if not value:
+        return (50, 90, 99)
+    try:
+        percentiles = tuple(float(part) for part in value.split(","))
+    except ValueError:
+        raise FilterError("percentiles", f"Invalid percentiles '{value}'.") from None
+    if not all(0 <= p <= 100 for p in percentiles):
+        raise FilterError("percentiles", "Percentiles must be between 0 and 100.")
+    return percentiles
+
+
+def parse_bins(params):
+    value = params.get("bins", "20")
+    try:
+        bins = int(value)
+    except ValueError:
+        raise FilterError("bins", f"Invalid bins '{value}'.") from None
+    if not 1 <= bins <= 1000:
+        raise FilterError("bins", "bins must be between 1 and 1000.")
+    return bins
+
+
+class DistributionAPIView(APIView):
+    @cache_analytics("distribution")
+    def get(self, request):
+        target_currency = request.query_params.get("currency", "USD").upper()
+        field = request.query_params.get("field", "converted_amount")
+        if field not in DISTRIBUTION_FIELDS:
+            return Response(
+                {"field": f"Unsupported field '{field}'. Use one of: {', '.join(DISTRIBUTION_FIELDS)}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            supported_currencies = get_supported_currencies()
+        except Exception as e:
             return Response(
                 {
-                    "currency": "USD",
-                    "average_invoice": round(avg_usd, 2)
-                }
+                    "detail": f"Unable to retrieve supported currencies at this time.Due To: {str(e)}"
+                },
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+        if target_currency not in supported_currencies:
+            return Response(
+                {
+                    "currency": f"Unsupported currency '{target_currency}'."
+                },
+                status=status.HTTP_400_BAD_REQUEST,
             )
+        try:
+            match = build_invoice_match(request.query_params, currency_param="invoice_currency")
+            percentiles = parse_percentiles(request.query_params)
+            bins = parse_bins(request.query_params)
+        except FilterError as e:
+            return Response({e.param: e.message}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Columns stay in memory until the next invoice write
+        try:
+            columns = column_cache.get()
+        except DistributionTooLarge as e:
+            return Response({"detail": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        result = distribution(columns, match, field, percentiles, bins)
 
-        # Convert average to requested currency
+        if field == "amount":
+            # Already in each invoice's own currency
+            return Response({"field": field, **result})
         try:
-            url = f"{base_url}/{api_key}/pair/USD/{target_currency}/{avg_usd}"
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
+            rate, rate_timestamp = get_usd_conversion(target_currency)
+        except Exception as e:
+            return conversion_failed(target_currency, e)
+        return Response(
+            {
+                "field": field,
+                "currency": target_currency,
+                "exchange_rate": rate,
+                "rate_timestamp": rate_timestamp,
+                "overall": scale_summary(result["overall"], rate),
+                "by_currency": {code: scale_summary(summary, rate) for code, summary in result["by_currency"].items()},
+            }
+        )
+
 
-            converted_avg = data["conversion_result"]
+
+class ApproximatePercentilesAPIView(APIView):
+    """Percentiles of converted_amount from the per-currency KLL sketches;
+    see invoices/sketches.py for the error bound."""
+
+    SKETCH_UNSUPPORTED = ("created_after", "created_before", "min_amount", "max_amount")
+
+    def get(self, request):
+        target_currency = request.query_params.get("currency", "USD").upper()
+        unsupported = [name for name in self.SKETCH_UNSUPPORTED if name in request.query_params]
+        if unsupported:
+            return Response(
+                {name: "Sketches are kept per currency only; use /analytics/distribution/ for this filter." for name in unsupported},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            supported_currencies = get_supported_currencies()
+        except Exception as e:
             return Response(
                 {
-                    "currency": target_currency,
-                    "average_invoice": round(converted_avg, 2),
-                }
+                    "detail": f"Unable to retrieve supported currencies at this time.Due To: {str(e)}"
+                },
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+        if target_currency not in supported_currencies:
+            return Response(
+                {
+                    "currency": f"Unsupported currency '{target_currency}'."
+                },
+                status=status.HTTP_400_BAD_REQUEST,
             )
+        try:
+            percentiles = parse_percentiles(request.query_params)
+        except FilterError as e:
+            return Response({e.param: e.message}, status=status.HTTP_400_BAD_REQUEST)
+        invoice_currency = request.query_params.get("invoice_currency")
+        key = invoice_currency.upper() if invoice_currency else RevenueCounter.ALL_KEY
+
+        # A few sketch shards, whatever the number of invoices
+        values, count, rank_error, stale = approximate_quantiles(key, [p / 100 for p in percentiles])
+
+        try:
+            rate, rate_timestamp = get_usd_conversion(target_currency)
+        except Exception as e:
+            return conversion_failed(target_currency, e)
+        return Response(
+            {
+                "currency": target_currency,
+                "count": count,
+                "percentiles": {f"p{p:g}": None if value is None else value * rate for p, value in zip(percentiles, values)},
+                "rank_error": rank_error,
+                "stale": stale,
+                "exchange_rate": rate,
+                "rate_timestamp": rate_timestamp,
+            }
+        )
+
+
+
+class RevenueByCurrencyAPIView(APIView):
+    @cache_analytics("revenue-by-currency")
+    def get(self, request):
+        target_currency = request.query_params.get("currency", "USD").upper()
+        try:
+            supported_currencies = get_supported_currencies()
         except Exception as e:
             return Response(
-                {"detail": f"Failed to convert USD to {target_currency}: {str(e)}"},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                {
+                    "detail": f"Unable to retrieve supported currencies at this time.Due To: {str(e)}"
+                },
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+        if target_currency not in supported_currencies:
+            return Response(
+                {
+                    "currency": f"Unsupported currency '{target_currency}'."
+                },
+                status=status.HTTP_400_BAD_REQUEST,
             )
+        try:
+            match = build_invoice_match(request.query_params, currency_param="invoice_currency")
+        except FilterError as e:
+            return Response({e.param: e.message}, status=status.HTTP_400_BAD_REQUEST)
+
+        # count/sum_amount/sum_usd per currency in a single $group
+        rows = revenue_by_currency(match)
+
+        # Every row converts with the same cached rate table
+        try:
+            rate, rate_timestamp = get_usd_conversion(target_currency)
+        except Exception as e:
+            return conversion_failed(target_currency, e)
+        return Response(
+            {
+                "currency": target_currency,
+                "exchange_rate": rate,
+                "rate_timestamp": rate_timestamp,
+                "total_count": sum(row["count"] for row in rows),
+                "total_revenue": round(sum(row["sum_usd"] for row in rows) * rate, 2),
+                "by_currency": [
+                    {
+                        "currency": row["currency"],
+                        "count": row["count"],
+                        "sum_amount": round(row["sum_amount"], 2),
+                        "sum_usd": round(row["sum_usd"], 2),
+                        "revenue": round(row["sum_usd"] * rate, 2),
+                    }
+                    for row in rows
+                ],
+            }
+        )
+
+
+def metrics(request):
+    """Prometheus scrape endpoint."""
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
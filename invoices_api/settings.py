@@ -14,6 +14,8 @@ from pathlib import Path
 
 import mongoengine
 
+from invoices.metrics import mongo_command_listener
+
 MONGO_DB_NAME = 'invoices_db'
 MONGO_HOST = 'mongodb://localhost:27017/invoices_db'
 
@@ -23,7 +25,9 @@ MONGO_HOST = "mongodb://localhost:27017"
 mongoengine.connect(
     db=MONGO_DB_NAME,
     host=MONGO_HOST,
-    alias="default"
+    alias="default",
+    # Per-command timings for the /metrics endpoint
+    event_listeners=[mongo_command_listener],
 )
 DATABASES = {
     'default': {
@@ -61,6 +65,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "invoices.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -93,6 +98,74 @@ WSGI_APPLICATION = "invoices_api.wsgi.application"
 EXCHANGE_API_KEY = "21f3ffff17ed3330cf6b1397"
 EXCHANGE_API_URL = "https://v6.exchangerate-api.com/v6"
 
+# Outbound provider calls share one pooled client (see invoices/http.py).
+EXCHANGE_API_CONNECT_TIMEOUT = 3.05  # seconds
+EXCHANGE_API_READ_TIMEOUT = 10  # seconds
+EXCHANGE_API_MAX_RETRIES = 2
+EXCHANGE_API_BACKOFF = 0.2  # seconds, doubled per retry and jittered
+EXCHANGE_API_BACKOFF_MAX = 2.0  # seconds
+EXCHANGE_API_POOL_SIZE = 10
+EXCHANGE_API_CIRCUIT_FAILURE_THRESHOLD = 5
+EXCHANGE_API_CIRCUIT_RESET_TIMEOUT = 30  # seconds
+
+# Where exchange rates come from (see invoices/providers.py):
+#   invoices.providers.HTTPProvider        the live API above
+#   invoices.providers.StaticFileProvider  a JSON rate file; OPTIONS: path
+#   invoices.providers.StubServerProvider  a local stub HTTP server; OPTIONS: path,
+#                                          latency, jitter, error_rate, error_status
+EXCHANGE_RATE_PROVIDER = {
+    "BACKEND": "invoices.providers.HTTPProvider",
+    "OPTIONS": {},
+}
+
+# Rate tables are cached in-process; cross rates are derived from the base table.
+EXCHANGE_RATE_BASE_CURRENCY = "USD"
+EXCHANGE_RATE_CACHE_TTL = 300  # seconds
+EXCHANGE_RATE_CACHE_MAX_ENTRIES = 32
+# Fetched tables are stored as snapshots (offline fallback, ?rates_as_of).
+# Every snapshot is kept this many days; before that, the last one of each day.
+EXCHANGE_RATE_SNAPSHOT_KEEP_DAYS = 7
+SUPPORTED_CURRENCIES_REFRESH_INTERVAL = 3600  # seconds
+
+# Background refresher that reloads the rate table before the cache expires.
+# Runs inside each web process when enabled, or via `manage.py refresh_rates`.
+EXCHANGE_RATE_REFRESHER_ENABLED = False
+EXCHANGE_RATE_REFRESH_INTERVAL = 240  # seconds, kept below the cache TTL
+EXCHANGE_RATE_REFRESH_JITTER = 0.1  # fraction of the interval
+
+# Analytics responses are cached until the next invoice write bumps the data
+# version. LocMemCache is per process: with several workers, switch to
+# django.core.cache.backends.filebased.FileBasedCache with a shared LOCATION
+# directory so they share entries and the version counter.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "invoices",
+    }
+}
+ANALYTICS_CACHE_ALIAS = "default"
+ANALYTICS_CACHE_TIMEOUT = 60  # seconds; bounds how old a cached exchange rate can be
+
+# Distribution analytics keep the invoice columns in memory as NumPy arrays
+DISTRIBUTION_BATCH_SIZE = 10000  # documents per cursor batch while loading
+DISTRIBUTION_MAX_ROWS = 5_000_000  # ~26 bytes per invoice
+
+# KLL sketch size for approximate percentiles; rank error ~2.296 / k**0.9723
+QUANTILE_SKETCH_K = 200
+# Sketch documents per key; concurrent writers spread over them, readers merge
+QUANTILE_SKETCH_SHARDS = 8
+
+# Invoice list pagination (?limit=, capped at the maximum)
+INVOICE_PAGE_SIZE = 50
+INVOICE_MAX_PAGE_SIZE = 500
+
+# Documents per MongoDB round trip (and per streamed chunk) for invoice exports
+INVOICE_EXPORT_BATCH_SIZE = 1000
+
+# Bulk invoice creation: items accepted per request and documents per insert_many
+INVOICE_BULK_MAX_ITEMS = 10000
+INVOICE_BULK_CHUNK_SIZE = 1000
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -2,8 +2,10 @@
 
 from django.contrib import admin
 from django.urls import path, include
+from invoices.views import metrics
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/", include("invoices.urls")),
+    path("metrics", metrics, name="metrics"),
 ]